@@ -1,16 +1,22 @@
 from dungen import Encounter, FloorData, DungenSave, StampInfo, WaterMaskElement
 
 import json
+import svg
 import time
+from dataclasses import asdict
 from pathlib import Path
 from typing import Optional, Tuple
 from uuid import UUID
-from flask import Flask, Response, abort, jsonify, url_for, render_template, request, send_file
+from flask import Flask, Response, abort, jsonify, url_for, render_template, request, send_file, stream_template
 from dungen import RoomInfo
+from dungen.drawing import iter_svg
+from dungen.floor_lod import DETAIL_LEVELS, draw_detail
+from dungen.level_drawer import compose_floor
 from .dungeons import DungenList
 from .stamps import StampRepository
 from .maps import render_as_map, render_for_viewer
 from .search import search_room_notes
+from .tiles import FloorCache, FloorRendition
 
 app = Flask(__name__)
 
@@ -29,6 +35,34 @@ def check_get_floor(dungeon: str, lvid: int, floorid: int) -> Tuple[DungenSave,
         app.logger.warn(f"Opening level {lvid} floor {floorid} in '{dungeon}' took {end - start} seconds.")
     return d, f
 
+def floor_img(d: DungenSave, lvid: int, f: FloorData) -> svg.SVG:
+    """Returns the image of a floor with any lower floors it shows through
+    to drawn in from their own records."""
+    def lower(floorid: int) -> Optional[svg.SVG]:
+        lower_floor = d.get_floor(lvid, floorid)
+        return lower_floor.img if lower_floor is not None else None
+    return compose_floor(f.img, lower)
+
+def floor_rendition(dungeon: str, lvid: int, floorid: int, lod: int = 0) -> FloorRendition:
+    """Returns a floor drawn at a level of detail, drawing it on first use."""
+    if not 0 <= lod < len(DETAIL_LEVELS):
+        abort(400)
+    def build() -> FloorRendition:
+        d, f = check_get_floor(dungeon, lvid, floorid)
+        return FloorRendition(draw_detail(floor_img(d, lvid, f), DETAIL_LEVELS[lod], d.scale))
+    return app.config["FLOOR_CACHE"].get((dungeon, lvid, floorid, lod), build)
+
+def viewer_img(dungeon: str, lvid: int, floorid: int, lod: int) -> Tuple[svg.SVG, bool]:
+    """Returns the image of a floor for the map viewer, and whether its
+    rooms, hallways, stamps and water are left out to be loaded as tiles.
+    Large floors are tiled at every level of detail."""
+    full = floor_rendition(dungeon, lvid, floorid)
+    tiled = full.index is not None and len(full.index) >= app.config["TILE_MIN_ELEMENTS"]
+    rendition = floor_rendition(dungeon, lvid, floorid, lod)
+    if tiled and rendition.index is not None:
+        return (rendition.index.skeleton(), True)
+    return (rendition.img, False)
+
 @app.route("/")
 def dungeon_index():
     return render_template(
@@ -60,7 +94,7 @@ def level_screen(dungeon: str, lvid: int, floorid: int):
         floorid = floorid,
         floors = d.floor_count(lvid),
         scale = d.scale,
-        img = f.img,
+        img = floor_img(d, lvid, f),
         book_url = app.config["BOOKS_URL"] if app.config["BOOKS_URL"] else "",
     )
 
@@ -83,17 +117,63 @@ def encounter_screen(dungeon: str, lvid: int, floorid: int, roomId: str):
 
 @app.route("/<dungeon>/map/<int:lvid>/<int:floorid>")
 def map_screen(dungeon: str, lvid: int, floorid: int):
-    d, f = check_get_floor(dungeon, lvid, floorid)
-    return render_template(
+    d = app.config["DUNGEONS"][dungeon]
+    if d is None:
+        abort(404)
+    # The page starts zoomed to the extents of the floor, so the overview is
+    # sent first and the viewer loads more detail if the view calls for it
+    lod = len(DETAIL_LEVELS) - 1
+    img, tiled = viewer_img(dungeon, lvid, floorid, lod)
+    return stream_template(
         "map_screen.html",
         lvid = lvid,
         floorid = floorid,
         dungen_name = dungeon,
         floors = d.floor_count(lvid),
         scale = d.scale,
-        img = render_for_viewer(f.img, d.scale),
+        img = render_for_viewer(img, d.scale),
+        tile_url = url_for("floor_tiles", dungeon = dungeon, lvid = lvid, floorid = floorid) if tiled else None,
+        detail_url = url_for("viewer_svg", dungeon = dungeon, lvid = lvid, floorid = floorid),
+        # Smallest zoom, in pixels per unit, each level of detail is shown at
+        detail_zooms = json.dumps([level.min_tile_px / d.scale for level in DETAIL_LEVELS]),
+        lod = lod,
     )
 
+@app.route("/api/map/<dungeon>/<int:lvid>/<int:floorid>")
+def viewer_svg(dungeon: str, lvid: int, floorid: int):
+    """Returns the image of a floor drawn for the map viewer at level of
+    detail lod."""
+    try:
+        lod = int(request.args.get("lod", 0))
+    except ValueError:
+        abort(400)
+    d = app.config["DUNGEONS"][dungeon]
+    if d is None:
+        abort(404)
+    img, _ = viewer_img(dungeon, lvid, floorid, lod)
+    return Response(render_for_viewer(img, d.scale), mimetype="image/svg+xml")
+
+@app.route("/api/tiles/<dungeon>/<int:lvid>/<int:floorid>")
+def floor_tiles(dungeon: str, lvid: int, floorid: int):
+    """Returns the indexed elements of a floor overlapping the box x0, y0,
+    x1, y1 at level of detail lod, leaving out those too small to see at
+    zoom pixels per unit."""
+    try:
+        x0, y0, x1, y1 = (float(request.args[k]) for k in ("x0", "y0", "x1", "y1"))
+        zoom = float(request.args.get("zoom", 0))
+        lod = int(request.args.get("lod", 0))
+    except (KeyError, ValueError):
+        abort(400)
+    start = time.time()
+    index = floor_rendition(dungeon, lvid, floorid, lod).index
+    if index is None:
+        abort(404)
+    items = index.query(x0, y0, x1, y1, zoom = zoom)
+    end = time.time()
+    if end - start > app.config["WARN_SECS"]:
+        app.logger.warn(f"Loading a tile of level {lvid} floor {floorid} in '{dungeon}' took {end - start} seconds.")
+    return jsonify({"items": [asdict(item) for item in items]})
+
 @app.route("/<dungeon>/search")
 def search_dungeon(dungeon:str):
     d = app.config["DUNGEONS"][dungeon]
@@ -120,12 +200,12 @@ def search_dungeon(dungeon:str):
 @app.route("/<dungeon>/export/<int:lvid>/<int:floorid>")
 def map_export(dungeon: str, lvid: int, floorid: int):
     d, f = check_get_floor(dungeon, lvid, floorid)
-    return Response(render_as_map(f.img, d.scale), mimetype="image/svg+xml")
+    return Response(render_as_map(floor_img(d, lvid, f), d.scale), mimetype="image/svg+xml")
 
 @app.route("/svg/<dungeon>/<int:lvid>/<int:floorid>")
 def raw_svg(dungeon: str, lvid: int, floorid: int):
-    _, f = check_get_floor(dungeon, lvid, floorid)
-    return Response(str(f.img), mimetype="image/svg+xml")
+    d, f = check_get_floor(dungeon, lvid, floorid)
+    return Response(iter_svg(floor_img(d, lvid, f)), mimetype="image/svg+xml")
 
 @app.route("/stamps/<path:path>")
 def get_stamp(path):
@@ -201,6 +281,7 @@ def update_floor(dungeon: str, lvid: int, floorid: int):
     f.set_stamps([StampInfo.from_dict(s) for s in request.json.get("stamps", [])])
     f.set_water_mask([WaterMaskElement(**e) for e in request.json.get("water", [])])
     d.set_floor(lvid, floorid, f)
+    app.config["FLOOR_CACHE"].discard_level(dungeon, lvid)
     end = time.time()
     if end - start > app.config["WARN_SECS"]:
         app.logger.warn(f"Saving level {lvid} floor {floorid} in '{dungeon}' took {end - start} seconds.")
@@ -212,6 +293,7 @@ def set_app_config(
     stamps_cache: Optional[Path] = None,
     books_url: Optional[str] = None,
     warn_duration: float = 1.0,
+    tile_min_elements: int = 2000,
 ) -> Optional[Flask]:
     """Return the DMScreen app with parameters set."""
 
@@ -238,6 +320,8 @@ def set_app_config(
 
     app.config["BOOKS_URL"] = books_url
     app.config["WARN_SECS"] = warn_duration
+    app.config["TILE_MIN_ELEMENTS"] = tile_min_elements
+    app.config["FLOOR_CACHE"] = FloorCache()
     return app
 
 def main_func():
@@ -272,6 +356,12 @@ def main_func():
         help = "Log a warning if operation takes longer than thiw many seconds.",
         default = 1,
     )
+    parser.add_argument(
+        "--tile-min-elements",
+        type = int,
+        help = "Load floors with at least this many rooms, hallways, stamps and water areas in tiles on the map screen.",
+        default = 2000,
+    )
     parser.add_argument(
         "--port",
         type = int,
@@ -281,7 +371,14 @@ def main_func():
     args = parser.parse_args()
 
     app.logger.setLevel(logging.DEBUG)
-    set_app_config(args.dungens_path, args.stamps_path, args.stamps_cache, args.books_url, args.warn_duration)
+    set_app_config(
+        args.dungens_path,
+        args.stamps_path,
+        args.stamps_cache,
+        args.books_url,
+        args.warn_duration,
+        args.tile_min_elements,
+    )
     app.run(port = args.port)
 
 if __name__ == "__main__":
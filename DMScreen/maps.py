@@ -1,9 +1,10 @@
 import svg
 
-from typing import List
-from dungen.drawing import find_element, append_children, remove_children
+from copy import copy
+from typing import Iterator, List
+from dungen.drawing import find_element, append_children, iter_svg, remove_children, replace_element
 
-def render_as_map(img: svg.SVG, scale: int) -> str:
+def render_as_map(img: svg.SVG, scale: int) -> Iterator[str]:
     fg_filter = svg.Filter(
         id = "fg-filter",
         elements = [
@@ -43,10 +44,10 @@ def render_as_map(img: svg.SVG, scale: int) -> str:
         append_children(img, "defs", [fg_filter])
         fg_el.filter = "url(#fg-filter)"
 
-    return str(img)
+    return iter_svg(img)
 
 
-def render_for_viewer(img: svg.SVG, scale: int) -> str:
+def render_for_viewer(img: svg.SVG, scale: int) -> Iterator[str]:
     shadow_filter = svg.Filter(
         id = "shadow_filter",
         elements = [
@@ -57,5 +58,9 @@ def render_for_viewer(img: svg.SVG, scale: int) -> str:
             svg.FeComposite(operator = "atop", in2="SourceGraphic"),
         ],
     )
-    append_children(img, "defs", [shadow_filter])
-    return str(img)
+    # img may be cached, so the filter is added to a copy
+    def add_filter(defs: svg.Element) -> svg.Element:
+        defs_copy = copy(defs)
+        defs_copy.elements = (defs.elements or []) + [shadow_filter]
+        return defs_copy
+    return iter_svg(replace_element(img, "defs", add_filter))
@@ -464,7 +464,7 @@ const stampMode = {
         ));
     },
     selectStamp: function(stamp) {
-        const svg = document.querySelector(".map svg g");
+        const svg = document.querySelector(".map svg > g");
         const prev_stamp = document.getElementById("stamp_preview");
         if (prev_stamp) {
             prev_stamp.remove();
@@ -708,7 +708,7 @@ const waterMode = {
     preview: null,
     showMaskPreview: function() {
         const scale = parseInt(document.querySelector(".map").dataset.scale);
-        const svg = document.querySelector(".map svg g");
+        const svg = document.querySelector(".map svg > g");
         const isCircle = this.currentShape === "circle";
         const tag = isCircle ? "circle" : "rect";
         const waterPrev = document.createElementNS(svg.namespaceURI, tag);
@@ -905,7 +905,7 @@ const sprayMode = {
     undoBuffer: [],
     showAreaPreview: function() {
         const scale = parseInt(document.querySelector(".map").dataset.scale);
-        const svg = document.querySelector(".map svg g");
+        const svg = document.querySelector(".map svg > g");
         const areaPrev = document.createElementNS(svg.namespaceURI, "rect");
         areaPrev.setAttributeNS(null, "id", "area_preview");
         areaPrev.setAttributeNS(null, "x", 0);
@@ -926,7 +926,7 @@ const sprayMode = {
     },
     sprayStamps: function() {
         if (stampMode.currentStamp && stampMode.currentStamp.href) {
-            const svg = document.querySelector(".map svg g");
+            const svg = document.querySelector(".map svg > g");
             const scale = parseInt(document.querySelector(".map").dataset.scale);
             const area = (scale * this.size) * (scale * this.size);
             const boxX = this.preview.x.animVal.value;
@@ -1032,7 +1032,7 @@ const copyMode = {
     size: 5,
     showAreaPreview: function() {
         const scale = parseInt(document.querySelector(".map").dataset.scale);
-        const svg = document.querySelector(".map svg g");
+        const svg = document.querySelector(".map svg > g");
         const areaPrev = document.createElementNS(svg.namespaceURI, "rect");
         areaPrev.setAttributeNS(null, "id", "area_preview");
         areaPrev.setAttributeNS(null, "x", 0);
@@ -101,6 +101,18 @@ document.addEventListener("DOMContentLoaded", function() {
     const svg_view = new SVGView(null, null, (ev) => {
         update_url_hash(svg_view.svg);
     });
+    const tiles = "tileurl" in svg_view.map.dataset ?
+        new TileLoader(svg_view, svg_view.map.dataset.tileurl)
+        : null;
+    const detail = new DetailSwitcher(
+        svg_view,
+        svg_view.map.dataset.detailurl,
+        JSON.parse(svg_view.map.dataset.detailzooms),
+        tiles,
+        parseInt(svg_view.map.dataset.lod),
+    );
+    svg_view.onzoom = (transform) => detail.schedule(transform);
+    detail.update(d3.zoomTransform(svg_view.svg));
 
     // Add in keyboard actions
     document.addEventListener("keydown", (ev) => {
@@ -136,7 +148,12 @@ j: Move to next floor down`
             }
         }
         else if (ev.key === 'r') {
-            reload_svg_img(svg_view.map.dataset.svgurl);
+            if (tiles !== null) {
+                tiles.reload();
+            }
+            else {
+                reload_svg_img(detail.currentUrl());
+            }
         }
         else if (ev.key === 's') {
             toggle_shadows(svg_view.svg);
@@ -6,17 +6,33 @@ class SVGView {
     ) {
         this.map = document.querySelector(".map");
         this.svg = this.map.querySelector(".map svg");
+        // Called with the new transform whenever the view moves
+        this.onzoom = null;
         const handleZoom = (ev) => {
-            d3.select(".map svg g").attr("transform", ev.transform);
+            d3.select(".map svg > g").attr("transform", ev.transform);
+            if (this.onzoom) {
+                this.onzoom(ev.transform);
+            }
         }
         this.zoom = d3.zoom().on("zoom", handleZoom);
         d3.select(".map svg").call(this.zoom);
         this.zoomToExtents();
     
-        const innerG = this.svg.querySelector("g");
-        innerG.addEventListener("click", onclick);
-        innerG.addEventListener("mousemove", onmousemove);
-        innerG.addEventListener("contextmenu", onrightclick);
+        this.listeners = {
+            click: onclick,
+            mousemove: onmousemove,
+            contextmenu: onrightclick,
+        };
+        this.attach();
+    }
+
+    attach() {
+        // Adds the mouse listeners to the map's top-level group. Called
+        // again whenever the group is swapped for a new one.
+        const innerG = this.svg.querySelector(":scope > g");
+        Object.entries(this.listeners).forEach(([type, listener]) => {
+            innerG.addEventListener(type, listener);
+        });
     }
         
     zoomToExtents() {
@@ -38,3 +54,201 @@ class SVGView {
         }, 1);
     }
 }
+
+class TileLoader {
+    // Fills in a floor sent without its rooms, hallways, stamps and water,
+    // fetching the elements in view from the tile API as the view moves.
+    constructor(svgView, url, tilePx = 512) {
+        this.view = svgView;
+        this.url = url;
+        this.tilePx = tilePx;
+        this.lod = 0;
+        this.parser = new DOMParser();
+        this.timeout = null;
+        this.clear();
+    }
+
+    clear() {
+        this.tiles = new Set();
+        this.keys = new Set();
+        // Inserted nodes and their order in each parent, kept sorted
+        this.placed = {};
+        this.generation = (this.generation || 0) + 1;
+    }
+
+    schedule(transform) {
+        if (this.timeout !== null) {
+            clearTimeout(this.timeout);
+        }
+        this.timeout = setTimeout(() => {
+            this.timeout = null;
+            this.update(transform);
+        }, 100);
+    }
+
+    update(transform) {
+        // Tiles are a fixed size on screen, so each zoom level has its own
+        // grid. Elements already loaded are skipped when they come again.
+        const level = Math.floor(Math.log2(transform.k));
+        const zoom = Math.pow(2, level);
+        const size = this.tilePx / zoom;
+        const padX = this.view.map.clientWidth / 2;
+        const padY = this.view.map.clientHeight / 2;
+        const x0 = (-padX - transform.x) / transform.k;
+        const y0 = (-padY - transform.y) / transform.k;
+        const x1 = (this.view.map.clientWidth + padX - transform.x) / transform.k;
+        const y1 = (this.view.map.clientHeight + padY - transform.y) / transform.k;
+        for (let tx = Math.floor(x0 / size); tx <= Math.floor(x1 / size); tx++) {
+            for (let ty = Math.floor(y0 / size); ty <= Math.floor(y1 / size); ty++) {
+                const key = `${level}:${tx}:${ty}`;
+                if (!this.tiles.has(key)) {
+                    this.tiles.add(key);
+                    this.load(tx * size, ty * size, (tx + 1) * size, (ty + 1) * size, zoom);
+                }
+            }
+        }
+    }
+
+    load(x0, y0, x1, y1, zoom) {
+        const generation = this.generation;
+        const params = new URLSearchParams({ x0, y0, x1, y1, zoom, lod: this.lod });
+        fetch(`${this.url}?${params}`).then((resp) => resp.json()).then((tile) => {
+            if (generation === this.generation) {
+                this.insert(tile.items.filter((item) => !this.keys.has(item.key)));
+            }
+        });
+    }
+
+    insert(items) {
+        if (items.length === 0) {
+            return;
+        }
+        const doc = this.parser.parseFromString(
+            `<svg xmlns="http://www.w3.org/2000/svg">${items.map((item) => item.text).join("")}</svg>`,
+            "image/svg+xml",
+        );
+        const nodes = Array.from(doc.documentElement.children);
+        items.forEach((item, i) => {
+            const parent = document.getElementById(item.parent);
+            if (parent === null || this.keys.has(item.key)) {
+                return;
+            }
+            this.keys.add(item.key);
+            const placed = this.placed[item.parent] || (this.placed[item.parent] = []);
+            let lo = 0;
+            let hi = placed.length;
+            while (lo < hi) {
+                const mid = (lo + hi) >> 1;
+                if (placed[mid].order < item.order) {
+                    lo = mid + 1;
+                }
+                else {
+                    hi = mid;
+                }
+            }
+            const node = document.importNode(nodes[i], true);
+            parent.insertBefore(node, lo < placed.length ? placed[lo].node : null);
+            placed.splice(lo, 0, { order: item.order, node });
+        });
+    }
+
+    reload() {
+        Object.values(this.placed).forEach((placed) => {
+            placed.forEach((p) => p.node.remove());
+        });
+        this.clear();
+        this.update(d3.zoomTransform(this.view.svg));
+    }
+
+    setDetail(lod) {
+        // The floor was swapped for another level of detail, taking the
+        // loaded elements with it
+        this.lod = lod;
+        this.clear();
+    }
+}
+
+class DetailSwitcher {
+    // Swaps the floor for a rendition with more or less detail as the view
+    // zooms in and out. zooms holds the smallest zoom of each level, and
+    // lod the level the page was sent with.
+    constructor(svgView, url, zooms, tiles = null, lod = 0) {
+        this.view = svgView;
+        this.url = url;
+        this.zooms = zooms;
+        this.tiles = tiles;
+        this.lod = lod;
+        this.wanted = lod;
+        if (tiles !== null) {
+            tiles.lod = lod;
+        }
+        this.parser = new DOMParser();
+        this.timeout = null;
+    }
+
+    levelFor(k) {
+        let lod = 0;
+        while (lod < this.zooms.length - 1 && k < this.zooms[lod]) {
+            lod++;
+        }
+        return lod;
+    }
+
+    currentUrl() {
+        return `${this.url}?lod=${this.lod}`;
+    }
+
+    schedule(transform) {
+        if (this.timeout !== null) {
+            clearTimeout(this.timeout);
+        }
+        this.timeout = setTimeout(() => {
+            this.timeout = null;
+            this.update(transform);
+        }, 100);
+    }
+
+    update(transform) {
+        const lod = this.levelFor(transform.k);
+        if (lod !== this.wanted) {
+            // A level still loading is dropped when it comes
+            this.wanted = lod;
+            if (lod !== this.lod) {
+                this.load(lod);
+                return;
+            }
+        }
+        if (lod === this.lod && this.tiles !== null) {
+            this.tiles.update(transform);
+        }
+    }
+
+    load(lod) {
+        fetch(`${this.url}?lod=${lod}`).then((resp) => resp.text()).then((text) => {
+            if (lod !== this.wanted) {
+                return;
+            }
+            const doc = this.parser.parseFromString(text, "image/svg+xml");
+            const svg = this.view.svg;
+            // Keep the view and the shadow toggle of the current floor
+            const transform = svg.querySelector(":scope > g").getAttribute("transform");
+            const fg = document.getElementById("fg-elements");
+            const filter = fg !== null ? fg.getAttribute("filter") : null;
+            svg.replaceChildren(...Array.from(doc.documentElement.children).map(
+                (node) => document.importNode(node, true)
+            ));
+            if (transform !== null) {
+                svg.querySelector(":scope > g").setAttribute("transform", transform);
+            }
+            this.view.attach();
+            if (filter !== null) {
+                document.getElementById("fg-elements").setAttribute("filter", filter);
+            }
+            this.lod = lod;
+            if (this.tiles !== null) {
+                this.tiles.setDetail(lod);
+                this.tiles.update(d3.zoomTransform(svg));
+            }
+        });
+    }
+}
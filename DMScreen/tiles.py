@@ -0,0 +1,51 @@
+import svg
+import threading
+
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from dungen.drawing import find_element
+from dungen.floor_index import FloorIndex
+from dungen.geometry import ShapeGroup
+
+# Dungeon, level, floor and level of detail
+FloorKey = Tuple[str, int, int, int]
+
+class FloorRendition:
+    """A floor drawn at one level of detail, and its spatial index if it
+    has batched shapes."""
+
+    def __init__(self, img: svg.SVG):
+        self.img = img
+        shapes = find_element(img, "shapes")
+        self.index: Optional[FloorIndex] = None
+        if isinstance(shapes, ShapeGroup) and shapes.shapes is not None:
+            self.index = FloorIndex(img)
+
+class FloorCache:
+    """Keeps the renditions of the most recently viewed floors, so zooming
+    and tile requests do not reload and redraw the floor."""
+
+    def __init__(self, size: int = 24):
+        self.size = size
+        self.__floors: "OrderedDict[FloorKey, FloorRendition]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: FloorKey, build: Callable[[], FloorRendition]) -> FloorRendition:
+        with self.__lock:
+            if key in self.__floors:
+                self.__floors.move_to_end(key)
+                return self.__floors[key]
+        rendition = build()
+        with self.__lock:
+            self.__floors[key] = rendition
+            while len(self.__floors) > self.size:
+                self.__floors.popitem(last = False)
+        return rendition
+
+    def discard_level(self, dungeon: str, lvid: int):
+        """Forgets every floor of a level. Floors show the floors below them,
+        so editing one floor can change the others."""
+        with self.__lock:
+            for key in [k for k in self.__floors if k[:2] == (dungeon, lvid)]:
+                del self.__floors[key]
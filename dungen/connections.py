@@ -1,9 +1,13 @@
-import random
+import math
 
+from collections import defaultdict
 from dataclasses import dataclass
-from typing import Collection, Iterator, Set, Tuple, cast
+from random import Random
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from uuid import UUID
 
 from .rooms import Room
+from .room_table import RoomTable
 
 @dataclass(frozen=True)
 class Bound:
@@ -44,43 +48,215 @@ class Hallway:
     def __hash__(self):
         return hash(self.room1) + hash(self.room2)
 
+class _DisjointSet:
+    """Union-find over the integers [0, size)."""
+
+    def __init__(self, size: int):
+        self._parent = list(range(size))
+        self._rank = [0] * size
+
+    def find(self, i: int) -> int:
+        while self._parent[i] != i:
+            self._parent[i] = self._parent[self._parent[i]]
+            i = self._parent[i]
+        return i
+
+    def union(self, a: int, b: int) -> bool:
+        """Joins the sets containing a and b. Returns False if they were
+        already joined."""
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return False
+        if self._rank[a] < self._rank[b]:
+            a, b = b, a
+        self._parent[b] = a
+        if self._rank[a] == self._rank[b]:
+            self._rank[a] += 1
+        return True
+
+class _SpatialGrid:
+    """Buckets points into square cells for nearest neighbour searches."""
+
+    def __init__(self, points: Sequence[Tuple[int, int]]):
+        self._points = points
+        min_x = min(p[0] for p in points)
+        min_y = min(p[1] for p in points)
+        max_x = max(p[0] for p in points)
+        max_y = max(p[1] for p in points)
+        # Aim for a couple of points per cell
+        self._cell = int(math.sqrt(
+            2 * max(1, max_x - min_x) * max(1, max_y - min_y) / len(points)
+        )) + 1
+        self._cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for i, (x, y) in enumerate(points):
+            self._cells[(x // self._cell, y // self._cell)].append(i)
+        self._min = (min_x // self._cell, min_y // self._cell)
+        self._max = (max_x // self._cell, max_y // self._cell)
+
+    def nearest(
+        self, i: int, k: int, skip: Callable[[int], bool] = lambda _: False
+    ) -> List[Tuple[int, int]]:
+        """Returns up to k (L1 distance, index) pairs closest to point i,
+        ignoring any index for which skip returns True."""
+        x, y = self._points[i]
+        cx, cy = x // self._cell, y // self._cell
+        max_r = max(
+            cx - self._min[0], self._max[0] - cx,
+            cy - self._min[1], self._max[1] - cy,
+        )
+        found: List[Tuple[int, int]] = []
+        for r in range(max_r + 1):
+            for gx in range(cx - r, cx + r + 1):
+                step = 1 if abs(gx - cx) == r else 2 * r
+                for gy in range(cy - r, cy + r + 1, step):
+                    for j in self._cells.get((gx, gy), ()):
+                        if j != i and not skip(j):
+                            px, py = self._points[j]
+                            found.append((abs(px - x) + abs(py - y), j))
+            # Anything outside ring r is further than r cells away
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= r * self._cell:
+                    break
+        found.sort()
+        return found[:k]
+
+def nearby_pairs(rooms: Sequence[Room], k: int) -> Set[Tuple[int, int]]:
+    """Returns index pairs connecting each room to its k nearest neighbours,
+    plus the shortest links needed to join the result into one component."""
+    if len(rooms) < 2:
+        return set()
+    if isinstance(rooms, RoomTable):
+        points = rooms.points()
+    else:
+        points = [(int(r.location.x), int(r.location.y)) for r in rooms]
+    grid = _SpatialGrid(points)
+    components = _DisjointSet(len(rooms))
+    pairs: Set[Tuple[int, int]] = set()
+    for i in range(len(rooms)):
+        for _, j in grid.nearest(i, k):
+            pairs.add((min(i, j), max(i, j)))
+            components.union(i, j)
+
+    # Link stray clusters to their closest neighbour until connected
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for i in range(len(rooms)):
+        groups[components.find(i)].append(i)
+    while len(groups) > 1:
+        root = min(groups, key = lambda g: len(groups[g]))
+        best: Tuple[int, int, int] = (-1, -1, -1)
+        for i in groups[root]:
+            match = grid.nearest(i, 1, lambda j: components.find(j) == root)
+            if match and (best[0] < 0 or match[0][0] < best[0]):
+                best = (match[0][0], i, match[0][1])
+        _, i, j = best
+        pairs.add((min(i, j), max(i, j)))
+        other = components.find(j)
+        members = groups.pop(root) + groups.pop(other)
+        components.union(i, j)
+        groups[components.find(i)] = members
+    return pairs
+
+# Available strategies for choosing which room pairs may get a hallway
+CANDIDATE_MODES = ("complete", "nearest")
+
 class Connections:
     """An adjency list of hallways between rooms"""
 
-    def __init__(self, rooms: Collection[Room]):
-        """Initializes the connection list by connecting all rooms 
-        to each other."""
-        self._rooms: Collection[Room] = rooms
-        self._hallways: Set[Hallway] = {
-            Hallway(s, e) for s in rooms for e in rooms if s != e
-        }
+    def __init__(
+        self,
+        rooms: Sequence[Room],
+        candidates: str = "complete",
+        neighbors: int = 8,
+    ):
+        """Initializes the connection list with candidate hallways.
+
+        With the "complete" mode every room is connected to every other
+        room. The "nearest" mode only connects each room to its nearest
+        neighbors, which keeps the number of hallways linear in the number
+        of rooms while still leaving every room reachable."""
+        # Materialize rows once so hallways share the same room objects
+        self._rooms: Sequence[Room] = tuple(rooms)
+        # Hallways are kept in a list so their order, and with it every
+        # random draw made while pruning and drawing, is reproducible.
+        if candidates not in CANDIDATE_MODES:
+            raise Exception(
+                f"{candidates} is not a recognized hallway candidate mode."
+                + f" Use one of: {', '.join(CANDIDATE_MODES)}."
+            )
+        if candidates == "complete":
+            self._hallways: List[Hallway] = [
+                Hallway(s, e)
+                for i, s in enumerate(self._rooms) for e in self._rooms[i + 1:]
+            ]
+        else:
+            self._hallways = [
+                Hallway(self._rooms[i], self._rooms[j])
+                for i, j in sorted(nearby_pairs(rooms, neighbors))
+            ]
+        self._adjacency: Optional[Dict[UUID, List[Hallway]]] = None
 
-    def room_hallways(self, room: Room) -> Set[Hallway]:
-        return {x for x in self._hallways if x.room1.id == room.id or x.room2.id == room.id}
+    @classmethod
+    def from_pairs(cls, rooms: Sequence[Room], pairs: Sequence[Tuple[int, int]]) -> "Connections":
+        """Creates connections holding a hallway for each pair of room
+        indexes, without adding or pruning any."""
+        conn = cls.__new__(cls)
+        conn._rooms = tuple(rooms)
+        conn._hallways = [Hallway(conn._rooms[i], conn._rooms[j]) for i, j in pairs]
+        conn._adjacency = None
+        return conn
+
+    def pairs(self) -> List[Tuple[int, int]]:
+        """Returns the hallways as pairs of room indexes."""
+        index = {r.id: i for i, r in enumerate(self._rooms)}
+        return [(index[h.room1.id], index[h.room2.id]) for h in self._hallways]
+
+    @property
+    def adjacency(self) -> Dict[UUID, List[Hallway]]:
+        """Map of room ids to the hallways touching that room, built on
+        first use."""
+        if self._adjacency is None:
+            self._adjacency = {r.id: [] for r in self._rooms}
+            for h in self._hallways:
+                self._adjacency[h.room1.id].append(h)
+                self._adjacency[h.room2.id].append(h)
+        return self._adjacency
 
-    def prune(self, density: float = 0.2):
-        """Prunes the numbers of hallways between rooms"""
+    def room_hallways(self, room: Room) -> List[Hallway]:
+        """Returns the hallways that start or end at room."""
+        return self.adjacency.get(room.id, [])
+
+    def degree(self, room: Room) -> int:
+        """Returns the number of hallways touching room."""
+        return len(self.room_hallways(room))
+
+    def neighbors(self, room: Room) -> List[Room]:
+        """Returns the rooms directly connected to room by a hallway."""
+        return [
+            h.room2 if h.room1.id == room.id else h.room1
+            for h in self.room_hallways(room)
+        ]
+
+    def prune(self, density: float = 0.2, rng: Optional[Random] = None):
+        """Prunes the hallways down to a minimum spanning tree, plus a random
+        selection of the remaining hallways proportional to density."""
         if len(self._rooms) < 2:
             return
-        mst_rooms: Set[Room] = { self._rooms[0] } # type: ignore[index]
-        mst_edges: Set[Hallway] = set()
-        adj_list = sorted(self._hallways)
-        curr_room = self._rooms[0] # type: ignore[index]
-        while len(mst_rooms) < len(self._rooms):
-            for edge in adj_list:
-                if edge.room1 == curr_room and edge.room2 not in mst_rooms:
-                    mst_edges.add(edge)
-                    mst_rooms.add(edge.room2)
-                    curr_room = edge.room2
-                    break
-                elif edge.room2 == curr_room and edge.room1 not in mst_rooms:
-                    mst_edges.add(edge)
-                    mst_rooms.add(edge.room1)
-                    curr_room = edge.room1
-                    break
-        self._hallways = mst_edges.union(
-            random.choices(adj_list, k = int(len(mst_edges) * density)) # type: ignore[arg-type]
+        if rng is None:
+            rng = Random()
+        index = {r.id: i for i, r in enumerate(self._rooms)}
+        components = _DisjointSet(len(self._rooms))
+        mst_edges: List[Hallway] = []
+        extra_edges: List[Hallway] = []
+        for edge in sorted(self._hallways, key = lambda h: h.distance):
+            if components.union(index[edge.room1.id], index[edge.room2.id]):
+                mst_edges.append(edge)
+            else:
+                extra_edges.append(edge)
+        self._hallways = mst_edges + rng.sample(
+            extra_edges, k = min(len(extra_edges), int(len(mst_edges) * density)),
         )
+        self._adjacency = None
 
     def __iter__(self) -> Iterator[Hallway]:
         return iter(self._hallways)
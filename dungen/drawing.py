@@ -1,6 +1,11 @@
 import svg
 from copy import copy
-from typing import List, Optional, Sequence
+from typing import Callable, Iterator, List, Optional, Sequence, TextIO
+
+from .geometry import ShapeGroup
+
+# Size in characters of the chunks iter_svg yields
+SVG_CHUNK_SIZE = 1 << 16
 
 def find_element(img: svg.SVG, id: str) -> Optional[svg.Element]:
     def find_from_list(
@@ -36,6 +41,27 @@ def append_children(
     parent.elements[index:index] = elements
     return True
 
+def replace_element(
+    img: svg.SVG,
+    id: str,
+    replace: Callable[[svg.Element], svg.Element],
+) -> svg.SVG:
+    """Returns a copy of img with the element id swapped for replace(element).
+    Only the elements on the way to it are copied, the rest are shared with
+    img, which is left unchanged."""
+    def rebuild(el: svg.Element) -> Optional[svg.Element]:
+        if el.elements is None:
+            return None
+        for i, child in enumerate(el.elements):
+            new = replace(child) if child.id == id else rebuild(child)
+            if new is not None:
+                el_copy = copy(el)
+                el_copy.elements = el.elements[:i] + [new] + el.elements[i + 1:]
+                return el_copy
+        return None
+    new_img = rebuild(img)
+    return new_img if isinstance(new_img, svg.SVG) else img
+
 def remove_children(img: svg.SVG, id: str, clsfilt: Optional[str] = None) -> bool:
     parent = find_element(img, id)
     if parent is None:
@@ -58,3 +84,50 @@ def strip_ids(elements: Optional[Sequence[svg.Element]]) -> Optional[List[svg.El
         el_copy.elements = strip_ids(el.elements)
         final_els.append(el_copy)
     return final_els
+
+def _open_tag(el: svg.Element) -> str:
+    # Mirrors the attribute formatting of svg.Element.as_str
+    props = " ".join(f'{k}="{v}"' for k, v in el.as_dict().items())
+    if el.data:
+        if props:
+            props += " "
+        props += " ".join(f'data-{k}="{v}"' for k, v in el.data.items())
+    if el.extra:
+        if props:
+            props += " "
+        props += " ".join(f'{k}="{v}"' for k, v in el.extra.items())
+    if props:
+        props = " " + props
+    return f"<{el.element_name}{props}>"
+
+def _svg_parts(el: svg.Element) -> Iterator[str]:
+    if isinstance(el, ShapeGroup):
+        yield from el.iter_str()
+    elif el.text or not el.elements or type(el).as_str is not svg.Element.as_str:
+        yield str(el)
+    else:
+        yield _open_tag(el)
+        for child in el.elements:
+            yield from _svg_parts(child)
+        yield f"</{el.element_name}>"
+
+def iter_svg(el: svg.Element, chunk_size: int = SVG_CHUNK_SIZE) -> Iterator[str]:
+    """Yields the same text as str(el) in chunks of roughly chunk_size
+    characters, so large floors can be written or sent without building the
+    whole document in memory."""
+    parts: List[str] = []
+    size = 0
+    for part in _svg_parts(el):
+        parts.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield "".join(parts)
+
+def write_svg(el: svg.Element, f: TextIO):
+    """Writes the SVG text of el to a file object."""
+    for chunk in iter_svg(el):
+        f.write(chunk)
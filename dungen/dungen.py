@@ -9,16 +9,24 @@ import random
 import svg
 import sys
 
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, cast
+from typing import Deque, Dict, List, Optional, Tuple, cast
 
-from .dunspec import DunSpec
+from . import profiling
+from .dunspec import DunSpec, rng_stream
 from .dungensave import DungenSave
 from .connections import Bound
 from .encounter import Encounter
+from .drawing import find_element
+from .geometry import PATH_PRECISION, ShapeGroup
 from .level import Level
-from .level_drawer import LevelDrawer, FillPatterns, handle_no_floors
+from .level_cache import LevelCache
+from .level_drawer import LevelDrawer, FillPatterns, compose_floor, handle_no_floors
+from .level_writer import FinishedLevel, LevelWriter
 from .room_generators import LevelSpec
+from .tiling import layout_tiled, uses_tiles
 from .rooms import Point, Stairs, Room
 
 # individual room drawers
@@ -34,18 +42,24 @@ drawer_map: Dict[str, LevelDrawer] = {
 }
 
 
-def create_level(
+def layout_level(
     spec: LevelSpec,
     entrances: List[Point],
-    level_textures: FillPatterns,
     level_number: int,
-    savefile: DungenSave,
     bottom_level: bool,
-) -> Tuple[List[Point], List[svg.SVG]]:
-    """Creates a level from a spec."""
-    imgs = []
+    seed: int,
+    executor: Optional[Executor] = None,
+) -> Tuple[List[Point], List[Level]]:
+    """Lays out the rooms and hallways of every floor in a level. Floors are
+    laid out in order, since the stairs up of a floor are placed at the
+    stairs down of the floor above it. Returns the stairs down of the last
+    floor along with the floors.
+
+    Floors larger than the tile_size extra are split into tiles, which are
+    laid out on executor when one is given."""
+    floors = []
     stairs_up = entrances
-    num_floors = random.randint(spec.floors.lower, spec.floors.upper)
+    num_floors = rng_stream(seed, level_number, "floors").randint(spec.floors.lower, spec.floors.upper)
     for floor_number in range(num_floors):
         stairs_bound = spec.stairs_down
         rooms_bound = spec.rooms
@@ -59,35 +73,63 @@ def create_level(
                 int(spec.rooms.upper * (floor_number / (num_floors - 1))),
             )
         
-        level = Level(
-            spec.updated(rooms = rooms_bound, stairs_down = stairs_bound),
-            stairs_up,
-            towers = spec.towers and floor_number < num_floors - 1,
-        )
-        stairs_up = [r.location for r in level.rooms if Stairs.DOWN in r.stairs]
+        floor_spec = spec.updated(rooms = rooms_bound, stairs_down = stairs_bound)
+        towers = spec.towers and floor_number < num_floors - 1
+        rng = rng_stream(seed, level_number, floor_number + 1)
+        with profiling.stage("layout", level = level_number, floor = floor_number + 1):
+            if uses_tiles(floor_spec):
+                level = layout_tiled(floor_spec, stairs_up, towers, rng, executor)
+            else:
+                level = Level(floor_spec, stairs_up, towers, rng)
+        stairs_up = list(level.rooms.with_stairs(Stairs.DOWN))
+        floors.append(level)
 
-        try:
-            drawer = drawer_map[spec.room_shape]
-        except KeyError:
-            raise Exception(f"{spec.room_shape} is not a recognized room shape.")
-        imgs.append(drawer.draw_level(
-            level,
-            level_textures,
-            scale = savefile.scale,
-            hall_width = spec.hall_width,
-            walls_in_fg = spec.extra.get("walls_in_fg", False),
-        ))
+    return (stairs_up, floors)
+
+
+def draw_floors(
+    spec: LevelSpec,
+    floors: List[Level],
+    level_textures: FillPatterns,
+    level_number: int,
+    scale: int,
+    seed: int,
+    serialize: bool = False,
+) -> Tuple[List[svg.SVG], List[str]]:
+    """Draws the floors of a level. When serialize is set, the SVG text of
+    each floor is returned as well."""
+    try:
+        drawer = drawer_map[spec.room_shape]
+    except KeyError:
+        raise Exception(f"{spec.room_shape} is not a recognized room shape.")
+    imgs = []
+    for floor_number, level in enumerate(floors):
+        with profiling.stage("draw", level = level_number, floor = floor_number + 1, shape = spec.room_shape):
+            imgs.append(drawer.draw_level(
+                level,
+                level_textures,
+                scale = scale,
+                hall_width = spec.hall_width,
+                walls_in_fg = spec.extra.get("walls_in_fg", False),
+                rng = rng_stream(seed, level_number, floor_number + 1, "draw"),
+                path_precision = spec.extra.get("path_precision", PATH_PRECISION),
+                path_tolerance = spec.extra.get("path_tolerance", 0.0),
+            ))
 
     if "no_floors" in spec.extra:
-        handle_no_floors(imgs, savefile.scale, **spec.extra["no_floors"])
+        with profiling.stage("no_floors", level = level_number):
+            handle_no_floors(imgs, scale, **spec.extra["no_floors"])
+
+    texts = []
+    if serialize:
+        for floor_number, img in enumerate(imgs):
+            with profiling.stage("serialize", level = level_number, floor = floor_number + 1):
+                texts.append(str(compose_floor(img, lambda n: imgs[n - 1])))
+    return (imgs, texts)
 
-    savefile.add_level(
-        level_number,
-        {i + 1: img for i, img in enumerate(imgs)},
-        f"Level {level_number}: {spec.name}\nThis level contains {floor_number + 1} floors.",
-    )
 
-    return (stairs_up, imgs) 
+def level_note(spec: LevelSpec, level_number: int, floor_count: int) -> str:
+    return f"Level {level_number}: {spec.name}\nThis level contains {floor_count} floors."
 
 
 def main_func():
@@ -122,6 +164,43 @@ def main_func():
         default = False,
         help = "Overwrite existing Dungen savefile.",
     )
+    parser.add_argument(
+        "--seed",
+        type = int,
+        default = None,
+        help = "Master random seed. Overrides the seed in the spec file.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type = int,
+        default = 1,
+        help = "Number of processes used to draw levels.",
+    )
+    parser.add_argument(
+        "--write-batch",
+        type = int,
+        default = 4,
+        help = "Number of levels written to the savefile per transaction.",
+    )
+    parser.add_argument(
+        "--cache",
+        type = Path,
+        default = None,
+        help = "Directory of previously generated levels to reuse when their inputs are unchanged.",
+    )
+    parser.add_argument(
+        "--profile",
+        action = "store_true",
+        default = False,
+        help = "Print the time and peak memory of each generation stage.",
+    )
+    parser.add_argument(
+        "--trace",
+        type = Path,
+        default = None,
+        help = "Write a Chrome trace of the generation stages to this file.",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -130,7 +209,13 @@ def main_func():
         help = "Print a summary.",
     )
     args = parser.parse_args()
+    profile = args.profile or args.trace is not None
+    if profile:
+        profiling.enable()
     spec = DunSpec.from_yaml(args.spec)
+    seed = args.seed if args.seed is not None else spec.seed
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
 
     if args.savefile.exists() and not (args.overwrite or args.append):
         # Exit when we try to overwrite without flag
@@ -142,69 +227,178 @@ def main_func():
         sys.exit(2)
     elif args.overwrite:
         # Overwite existing file
-        args.savefile.unlink()
+        DungenSave.remove(args.savefile)
 
     savefile = DungenSave(args.savefile, scale = spec.scale)
-    stairs_up: Optional[List[Point]] = None
-
-    if args.savefile.exists() and args.append:
-        # Add stairs down
-        last_level = savefile.levels
-        last_floor_num = savefile.floor_count(last_level)
-        last_floor = savefile.get_floor(last_level, last_floor_num)
-        if last_floor is None:
-            raise AttributeError("Error: cannot append to file, it is malformed")
-        room_els = last_floor.room_elements()
-        selected_rooms = random.choices(room_els, k = spec.entrances)
-        for room in selected_rooms:
-            # Edit classes to make stairs go down here
-            room.class_.append("down") # type: ignore[attr-defined]
-            if room.data is None:
+    try:
+        stairs_up: Optional[List[Point]] = None
+
+        if args.savefile.exists() and args.append:
+            # Add stairs down
+            last_level = savefile.levels
+            last_floor_num = savefile.floor_count(last_level)
+            last_floor = savefile.get_floor(last_level, last_floor_num)
+            if last_floor is None:
                 raise AttributeError("Error: cannot append to file, it is malformed")
-            room.data["room-note"] += "There are stairs down here.\n"
-        savefile.set_floor(last_level, last_floor_num, last_floor)
-        stairs_up = [Point.from_dict(room.data) for r in selected_rooms] # type: ignore[arg-type]
-
-    starting_levels = savefile.levels
-    for i in progressbar.progressbar(range(1, spec.level_count + 1)):
-        i += starting_levels
-        level_spec, = random.choices(spec.levels, weights=[ls.probability for ls in spec.levels])
-        if stairs_up is None:
-            stairs_up = [
-                Point(
-                    random.randint(0, level_spec.width - level_spec.room_width.upper), 
-                    random.randint(0, level_spec.height - level_spec.room_height.upper), 
-                ) for _ in range(spec.entrances)
-            ]
-        stairs_up, imgs = create_level(
-            level_spec,
-            stairs_up,
-            spec.textures[level_spec],
-            i,
+            room_els = last_floor.room_elements()
+            selected_rooms = rng_stream(seed, "append", last_level).choices(room_els, k = spec.entrances)
+            for room in selected_rooms:
+                # Edit classes to make stairs go down here
+                room.class_.append("down") # type: ignore[attr-defined]
+                if room.data is None:
+                    raise AttributeError("Error: cannot append to file, it is malformed")
+                room.data["room-note"] += "There are stairs down here.\n"
+            savefile.set_floor(last_level, last_floor_num, last_floor)
+            stairs_up = [Point.from_dict(room.data) for r in selected_rooms] # type: ignore[arg-type]
+
+        starting_levels = savefile.levels
+        cache = LevelCache(args.cache) if args.cache is not None else None
+        pending: Deque[Tuple[LevelSpec, int, Future, Optional[str], List[Point]]] = deque()
+
+        def collect(drawn: Future) -> Tuple[List[svg.SVG], List[str]]:
+            result, records = drawn.result()
+            profiling.add_records(records)
+            return result
+
+        writer = LevelWriter(
             savefile,
-            i - starting_levels == spec.level_count,
+            args.svg_out,
+            batch = args.write_batch,
+            depth = 2 * args.write_batch,
+            cache = cache,
         )
+        pool = ProcessPoolExecutor(args.jobs) if args.jobs > 1 else None
+        try:
+            with writer, progressbar.ProgressBar(max_value = spec.level_count) as bar:
+                def finish(
+                    level_spec: LevelSpec,
+                    i: int,
+                    drawn: Tuple[List[svg.SVG], List[str]],
+                    cache_key: Optional[str] = None,
+                    stairs_down: Optional[List[Point]] = None,
+                ):
+                    imgs, svg_text = drawn
+                    writer.put(FinishedLevel(
+                        i,
+                        {j + 1: img for j, img in enumerate(imgs)},
+                        level_note(level_spec, i, len(imgs)),
+                        svg_text,
+                        cache_key,
+                        stairs_down,
+                    ))
+                    bar.increment()
+
+                for i in range(1, spec.level_count + 1):
+                    i += starting_levels
+                    level_rng = rng_stream(seed, i)
+                    level_spec, = level_rng.choices(spec.levels, weights=[ls.probability for ls in spec.levels])
+                    if stairs_up is None:
+                        stairs_up = [
+                            Point(
+                                level_rng.randint(0, level_spec.width - level_spec.room_width.upper), 
+                                level_rng.randint(0, level_spec.height - level_spec.room_height.upper), 
+                            ) for _ in range(spec.entrances)
+                        ]
+
+                    bottom_level = i - starting_levels == spec.level_count
+                    key = None
+                    if cache is not None:
+                        key = LevelCache.key(
+                            level_spec,
+                            spec.texture_hash(level_spec),
+                            i,
+                            stairs_up,
+                            bottom_level,
+                            seed,
+                            savefile.scale,
+                        )
+                        cached = cache.get(key)
+                        if cached is not None:
+                            # Only the stairs of a level feed into the next one
+                            stairs_up, imgs = cached
+                            if pool is None:
+                                finish(level_spec, i, (imgs, []))
+                            else:
+                                done: Future = Future()
+                                done.set_result(((imgs, []), []))
+                                pending.append((level_spec, i, done, None, stairs_up))
+                            continue
+
+                    # Only the stairs carry over between levels, so with a pool
+                    # levels are laid out here and drawn in the workers. Levels are
+                    # saved in order, keeping a few in flight per worker.
+                    stairs_up, floors = layout_level(
+                        level_spec,
+                        stairs_up,
+                        i,
+                        bottom_level,
+                        seed,
+                        pool,
+                    )
+                    if pool is None:
+                        finish(level_spec, i, draw_floors(
+                            level_spec,
+                            floors,
+                            spec.textures[level_spec],
+                            i,
+                            savefile.scale,
+                            seed,
+                        ), key, stairs_up)
+                        continue
+
+                    pending.append((level_spec, i, pool.submit(
+                        profiling.run_recorded,
+                        profile,
+                        draw_floors,
+                        level_spec,
+                        floors,
+                        spec.textures[level_spec],
+                        i,
+                        savefile.scale,
+                        seed,
+                        serialize = args.svg_out is not None,
+                    ), key, stairs_up))
+                    while len(pending) > 2 * args.jobs:
+                        level_spec, i, drawn, key, stairs_down = pending.popleft()
+                        finish(level_spec, i, collect(drawn), key, stairs_down)
+
+                while pending:
+                    level_spec, i, drawn, key, stairs_down = pending.popleft()
+                    finish(level_spec, i, collect(drawn), key, stairs_down)
+        finally:
+            # Drops the levels still queued if generation stops early
+            if pool is not None:
+                pool.shutdown(cancel_futures = True)
+
+        if profile:
+            records = profiling.drain()
+            if args.trace is not None:
+                profiling.write_trace(records, args.trace)
+            if args.profile:
+                profiling.print_summary(records, sys.stdout)
 
-        if args.svg_out is not None:
-            args.svg_out.mkdir(exist_ok = True)
-            level_dir = args.svg_out.joinpath(f"level_{i}")
-            level_dir.mkdir(exist_ok = True)
-            for j, img in enumerate(imgs):
-                svg_path = level_dir.joinpath(f"floor_{j + 1}.svg")
-                svg_path.write_text(str(img))
-
-    if args.verbose:
-        print(f"Dungeon has {savefile.levels} levels:")
-        for lvlid in range(1, savefile.levels + 1):
-            print(f"  Level {lvlid}")
-            for floorid in range(1, savefile.floor_count(lvlid) + 1):
-                floor = savefile.get_floor(lvlid, floorid)
-                if floor is None:
-                    print(f"    Missing! Floor {floorid}")
-                    continue
-                down_c = len(floor.room_elements("down"))
-                up_c = len(floor.room_elements("up"))
-                print(f"    Floor {floorid}: {len(floor.room_elements())} Rooms [{up_c} U {down_c} D].")
+        if args.verbose:
+            print(f"Generated with seed {seed}.")
+            print(f"Dungeon has {savefile.levels} levels:")
+            for lvlid in range(1, savefile.levels + 1):
+                print(f"  Level {lvlid}")
+                for floorid in range(1, savefile.floor_count(lvlid) + 1):
+                    floor = savefile.get_floor(lvlid, floorid)
+                    if floor is None:
+                        print(f"    Missing! Floor {floorid}")
+                        continue
+                    down_c = len(floor.room_elements("down"))
+                    up_c = len(floor.room_elements("up"))
+                    print(f"    Floor {floorid}: {len(floor.room_elements())} Rooms [{up_c} U {down_c} D].")
+                    shapes = find_element(floor.img, "shapes")
+                    if isinstance(shapes, ShapeGroup) and shapes.shapes is not None and shapes.shapes.points_before:
+                        batch = shapes.shapes
+                        print(
+                            f"      Simplified paths keep {batch.points_after} of {batch.points_before} points"
+                            + f" ({batch.points_after / batch.points_before:.1%})."
+                        )
+    finally:
+        savefile.close()
 
 if __name__ == "__main__":
     main_func()
@@ -1,14 +1,20 @@
+import copyreg
+import hashlib
+import io
 import json
+import os
 import pickle
 import sqlite3
 import svg
+import threading
 from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import cast, Dict, Iterator, List, Optional, Tuple, Union
+from typing import cast, Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple, Union
 from urllib.parse import quote, unquote
 from uuid import UUID
 
+from . import profiling
 from .drawing import append_children, find_element, remove_children
 from .encounter import Encounter
 
@@ -167,6 +173,131 @@ class FloorData:
             raise AttributeError("Water element not in floor image")
 
 
+def _texture_image(key: str, x: Any, y: Any, width: Any, height: Any) -> svg.Image:
+    """Stand in for texture images in pickled floors. Floors are loaded with
+    _FloorUnpickler, which swaps this for a lookup in the textures table."""
+    raise pickle.UnpicklingError("Floors with stored textures must be loaded through DungenSave")
+
+class _FloorPickler(pickle.Pickler):
+    """Pickles floor images with embedded texture images replaced by
+    references to the textures table. New textures are collected in
+    `found`, keyed by the hash of their data URI."""
+
+    def __init__(self, file: io.BytesIO, keys: Dict[str, str]):
+        super().__init__(file, pickle.DEFAULT_PROTOCOL)
+        self.keys = keys
+        self.found: Dict[str, str] = {}
+        # Only images go through Python code, everything else is pickled
+        # at full speed
+        self.dispatch_table = copyreg.dispatch_table.copy()
+        self.dispatch_table[svg.Image] = self.reduce_image
+
+    def reduce_image(self, obj: svg.Image) -> Any:
+        # Only plain texture images, anything else (such as a rotated
+        # stamp) is pickled as is
+        if (
+            not isinstance(obj.href, str)
+            or not obj.href.startswith("data:")
+            or obj != svg.Image(href = obj.href, x = obj.x, y = obj.y, width = obj.width, height = obj.height)
+        ):
+            return obj.__reduce_ex__(pickle.DEFAULT_PROTOCOL)
+        key = self.keys.get(obj.href)
+        if key is None:
+            key = hashlib.sha256(obj.href.encode()).hexdigest()
+            self.keys[obj.href] = key
+        self.found[key] = obj.href
+        return (_texture_image, (key, obj.x, obj.y, obj.width, obj.height))
+
+class _FloorUnpickler(pickle.Unpickler):
+    """Loads floor images, putting textures back from the textures table."""
+
+    def __init__(self, file: io.BytesIO, texture: Callable[[str], str]):
+        super().__init__(file)
+        self.texture = texture
+
+    def find_class(self, module: str, name: str) -> Any:
+        if module == __name__ and name == "_texture_image":
+            return self.texture_image
+        return super().find_class(module, name)
+
+    def texture_image(self, key: str, x: Any, y: Any, width: Any, height: Any) -> svg.Image:
+        return svg.Image(href = self.texture(key), x = x, y = y, width = width, height = height)
+
+
+# Settings for every savefile connection. In WAL mode readers are not
+# blocked by a write in progress, and synchronous NORMAL only syncs on
+# checkpoints, which is safe with WAL.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    # In KiB when negative
+    "cache_size": -32768,
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+# Version of the savefile layout. Savefiles written by older versions are
+# migrated when opened:
+#   1: no version, floors unindexed, textures table added on first write
+#   2: version in meta, floors indexed by (lvlid, floorid)
+SCHEMA_VERSION = 2
+
+class _ConnectionPool:
+    """Keeps open connections to a savefile for reuse, so each call does
+    not pay for opening the file and reading its schema. A connection is
+    used by one thread at a time, and threads that need one together get
+    one each."""
+
+    def __init__(self, path: Path, size: int = 4):
+        self.path = path
+        self.size = size
+        self.__idle: List[sqlite3.Connection] = []
+        self.__pid = os.getpid()
+        self.__lock = threading.Lock()
+
+    def __connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout = 20,
+            # The journal mode cannot change inside a transaction
+            autocommit = True,
+            # Connections are handed from thread to thread
+            check_same_thread = False,
+        )
+        for pragma, value in SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        conn.autocommit = False
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        with self.__lock:
+            if self.__pid != os.getpid():
+                # Connections cannot be shared with a forked process
+                self.__idle = []
+                self.__pid = os.getpid()
+            conn = self.__idle.pop() if self.__idle else None
+        if conn is None:
+            conn = self.__connect()
+        try:
+            yield conn
+        finally:
+            # Ends the read transaction too, so the next use sees the
+            # latest writes. Writes are committed before this.
+            conn.rollback()
+            with self.__lock:
+                if len(self.__idle) < self.size:
+                    self.__idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        """Closes the idle connections."""
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+        for conn in idle:
+            conn.close()
+
 class DungenSave:
     """Savefile definition for DunGen files."""
     def __init__(self, file: Path, scale: Optional[int] = None):
@@ -174,34 +305,44 @@ class DungenSave:
         self.__save_count = 0
         self.__scale = scale
         self.__levels = None
+        # Texture data URIs by content hash, and the reverse
+        self.__textures: Dict[str, str] = {}
+        self.__texture_keys: Dict[str, str] = {}
+        self.__pool = _ConnectionPool(file)
         if not self.filepath.exists():
             if scale is None:
                 raise AttributeError("Must supply scale when creating a new savefile")
             self.__create_tables(scale)
             self.__levels = 0
+        else:
+            self.__migrate()
 
     def __hash__(self):
         return hash(self.filepath) + self.__save_count
 
-    @contextmanager
-    def __open_tables(self) -> Iterator[sqlite3.Connection]:
-        conn = sqlite3.connect(
-            self.filepath,
-            timeout = 20,
-            autocommit = False,
-        )
-        try:
-            yield conn
-        finally:
-            conn.close()
+    def __open_tables(self) -> ContextManager[sqlite3.Connection]:
+        return self.__pool.connection()
+
+    def close(self):
+        """Closes the savefile's connections, which lets SQLite fold its
+        write-ahead log back into the file."""
+        self.__pool.close()
+
+    @staticmethod
+    def remove(file: Path):
+        """Deletes a savefile along with its write-ahead log."""
+        for path in (file, file.with_name(file.name + "-wal"), file.with_name(file.name + "-shm")):
+            path.unlink(missing_ok = True)
 
     def __create_tables(self, scale: int):
         with self.__open_tables() as conn:
             cur = conn.cursor()
-            cur.execute("CREATE TABLE meta(scale INT)")
-            cur.execute("INSERT INTO meta VALUES(?)", (scale,))
+            cur.execute("CREATE TABLE meta(scale INT, version INT)")
+            cur.execute("INSERT INTO meta VALUES(?, ?)", (scale, SCHEMA_VERSION))
             cur.execute("CREATE TABLE levels(lvlid INT PRIMARY KEY, note TEXT, floors INT)")
             cur.execute("CREATE TABLE floors(lvlid INT, floorid INT, img BLOB)")
+            cur.execute(self.__floors_index_schema)
+            cur.execute(self.__textures_schema)
             conn.commit()
             cur.execute("CREATE TRIGGER levels_trigger BEFORE UPDATE OF lvlid, floors ON levels BEGIN\n"
                 + "SELECT RAISE(FAIL, 'Property is non-editable');\nEND"
@@ -212,6 +353,73 @@ class DungenSave:
             conn.commit()
             self.__save_count += 1
 
+    __textures_schema = "CREATE TABLE IF NOT EXISTS textures(hash TEXT PRIMARY KEY, href TEXT)"
+    # Floors are looked up by level and floor, which without an index
+    # scans every floor image in the file
+    __floors_index_schema = "CREATE UNIQUE INDEX floors_key ON floors(lvlid, floorid)"
+
+    @staticmethod
+    def __schema_version(cur: sqlite3.Cursor) -> int:
+        cur.execute("PRAGMA table_info(meta)")
+        if "version" not in [column[1] for column in cur.fetchall()]:
+            return 1
+        cur.execute("SELECT version FROM meta")
+        version, = cur.fetchone()
+        return version
+
+    def __migrate(self):
+        """Brings a savefile written by an older version up to date."""
+        with self.__open_tables() as conn:
+            cur = conn.cursor()
+            version = self.__schema_version(cur)
+            if version > SCHEMA_VERSION:
+                raise AttributeError(f"Savefile version {version} is newer than this version of dungen supports")
+            if version == SCHEMA_VERSION:
+                return
+            # Take the write lock before checking again, so two processes
+            # opening the file at once do not both migrate it
+            conn.rollback()
+            cur.execute("UPDATE meta SET scale = scale")
+            version = self.__schema_version(cur)
+            if version < 2:
+                cur.execute(self.__textures_schema)
+                # Keep the floor that lookups found first
+                cur.execute(
+                    "DELETE FROM floors WHERE rowid NOT IN (SELECT MIN(rowid) FROM floors GROUP BY lvlid, floorid)"
+                )
+                cur.execute(self.__floors_index_schema)
+                cur.execute("ALTER TABLE meta ADD COLUMN version INT")
+            cur.execute("UPDATE meta SET version = ?", (SCHEMA_VERSION,))
+            conn.commit()
+            self.__save_count += 1
+
+    def __dump_floor(self, img: svg.SVG, textures: Dict[str, str]) -> bytes:
+        """Pickles a floor image, adding the textures it uses to textures."""
+        buf = io.BytesIO()
+        pickler = _FloorPickler(buf, self.__texture_keys)
+        pickler.dump(img)
+        textures.update(pickler.found)
+        return buf.getvalue()
+
+    def __store_textures(self, cur: sqlite3.Cursor, textures: Dict[str, str]):
+        """Adds textures that are not in the savefile yet."""
+        cur.executemany("INSERT OR IGNORE INTO textures(hash, href) VALUES(?, ?)", textures.items())
+
+    def __texture(self, key: str) -> str:
+        """Returns the data URI of a stored texture."""
+        if key not in self.__textures:
+            with self.__open_tables() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT href FROM textures WHERE hash = ?", (key,))
+                res = cur.fetchone()
+            if res is None:
+                raise AttributeError(f"Texture {key} is missing from the savefile")
+            self.__textures[key], = res
+        return self.__textures[key]
+
+    def __load_floor(self, data: bytes) -> svg.SVG:
+        return _FloorUnpickler(io.BytesIO(data), self.__texture).load()
+
     @property
     def scale(self) -> int:
         if self.__scale is None:
@@ -241,11 +449,22 @@ class DungenSave:
 
     def add_level(self, lvlid: int, floors: Dict[int, svg.SVG], note: str):
         """Adds a new level to the table under the previous level."""
-        with self.__open_tables() as conn:
+        self.add_levels([(lvlid, floors, note)])
+
+    def add_levels(self, levels: List[Tuple[int, Dict[int, svg.SVG], str]]):
+        """Adds several (lvlid, floors, note) levels in a single transaction."""
+        rows = []
+        textures: Dict[str, str] = {}
+        for lvlid, floors, _ in levels:
+            with profiling.stage("pickle", level = lvlid):
+                rows += [(lvlid, i, self.__dump_floor(img, textures)) for i, img in floors.items()]
+        with profiling.stage("sqlite_write", levels = [l[0] for l in levels]), self.__open_tables() as conn:
             cur = conn.cursor()
-            cur.execute("INSERT INTO levels(lvlid, note, floors) VALUES(?, ?, ?)", (lvlid, note, len(floors)))
-            for i, img in floors.items():
-                cur.execute("INSERT INTO floors(lvlid, floorid, img) VALUES(?, ?, ?)", (lvlid, i, pickle.dumps(img)))
+            self.__store_textures(cur, textures)
+            cur.executemany("INSERT INTO levels(lvlid, note, floors) VALUES(?, ?, ?)", [
+                (lvlid, note, len(floors)) for lvlid, floors, note in levels
+            ])
+            cur.executemany("INSERT INTO floors(lvlid, floorid, img) VALUES(?, ?, ?)", rows)
             conn.commit()
             self.__save_count += 1
             self.__levels = None
@@ -264,18 +483,20 @@ class DungenSave:
             cur = conn.cursor()
             cur.execute("SELECT img FROM floors WHERE lvlid = ? AND floorid = ?", (lvlid, floorid))
             res = cur.fetchone()
-            if len(res) != 1:
+            if res is None:
                 return None
             img_pickle, = res
-        img = pickle.loads(img_pickle)
-        return FloorData(img)
+        return FloorData(self.__load_floor(img_pickle))
 
     def set_floor(self, lvlid: int, floorid: int, floor: FloorData):
         """Sets the contents of the floor image."""
+        textures: Dict[str, str] = {}
+        img = self.__dump_floor(floor.img, textures)
         with self.__open_tables() as conn:
             cur = conn.cursor()
+            self.__store_textures(cur, textures)
             cur.execute("UPDATE floors SET img = ? WHERE lvlid = ? AND floorid = ?",
-                (pickle.dumps(floor.img), lvlid, floorid),
+                (img, lvlid, floorid),
             )
             conn.commit()
             self.__save_count += 1
@@ -1,12 +1,15 @@
+import hashlib
 import yaml
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from random import Random
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Union
 
+from . import profiling
 from .room_generators import LevelSpec
 from .connections import Bound
-from .level_drawer import FillPatterns, paths_to_patterns
+from .level_drawer import FillPatterns, TexturePaths, TextureRegistry
 
 
 class DunSpecLoader(yaml.SafeLoader):
@@ -23,6 +26,47 @@ def construct_use(loader: DunSpecLoader, node: yaml.Node) -> Any:
 
 yaml.add_constructor("!use", construct_use, DunSpecLoader)
 
+def rng_stream(seed: int, *keys: Union[int, str]) -> Random:
+    """Returns a random number generator for the stream named by keys.
+    The same seed and keys always give the same stream, independent of any
+    other stream or process."""
+    return Random(":".join(str(k) for k in (seed, *keys)))
+
+class LevelTextures(Mapping[LevelSpec, FillPatterns]):
+    """Fill patterns of each level, encoded through a shared registry the
+    first time a level is looked up."""
+
+    def __init__(
+        self,
+        paths: Dict[LevelSpec, TexturePaths],
+        scale: int,
+        registry: Optional[TextureRegistry] = None,
+    ):
+        self.paths = paths
+        self.scale = scale
+        self.registry = registry if registry is not None else TextureRegistry()
+        self._patterns: Dict[LevelSpec, FillPatterns] = {}
+
+    def __getitem__(self, level: LevelSpec) -> FillPatterns:
+        if level not in self._patterns:
+            self._patterns[level] = self.registry.fill_patterns(self.paths[level], self.scale)
+        return self._patterns[level]
+
+    def __iter__(self) -> Iterator[LevelSpec]:
+        return iter(self.paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def digest(self, level: LevelSpec) -> str:
+        """Returns a hash of the texture files and settings of a level."""
+        paths = self.paths[level]
+        digest = hashlib.sha256()
+        for fp in paths.files():
+            digest.update(self.registry.digest(fp).encode())
+        digest.update(repr((self.scale, paths.background_grid, paths.room_grid, paths.hall_grid)).encode())
+        return digest.hexdigest()
+
 @dataclass(frozen=True)
 class DunSpec:
     """A DunSpec provides the specification for how to generate an entire dungeon."""
@@ -34,7 +78,7 @@ class DunSpec:
     levels: List[LevelSpec]
     
     # Textures to use for the different levels.
-    textures: Dict[LevelSpec, FillPatterns]
+    textures: Mapping[LevelSpec, FillPatterns]
 
     # Scale of tiles. Set this to the size of patterns.
     scale: int = 1
@@ -42,13 +86,27 @@ class DunSpec:
     # Number of (top) entrances to the dungeon.
     entrances: int = 1
 
+    # Master seed that every level and floor stream is derived from.
+    seed: Optional[int] = None
+
+    def texture_hash(self, level: LevelSpec) -> str:
+        """Returns a hash of the textures of a level, if they are known."""
+        if isinstance(self.textures, LevelTextures):
+            return self.textures.digest(level)
+        return ""
+
     @classmethod
     def from_yaml(cls, spec_file: Path) -> "DunSpec":
+        with profiling.stage("load_spec"):
+            return cls._from_yaml(spec_file)
+
+    @classmethod
+    def _from_yaml(cls, spec_file: Path) -> "DunSpec":
         with spec_file.open() as sf:
             spec = yaml.load(sf, DunSpecLoader)
         scale_factor = spec.get("scale", 1)
         level_specs: Dict[str, LevelSpec] = {}
-        textures: Dict[LevelSpec, FillPatterns] = {}
+        texture_paths: Dict[LevelSpec, TexturePaths] = {}
         dict_to_bound = lambda d: Bound(d["lower"], d["upper"])
         for name, level in spec["floor_types"].items():
             level_specs[name] = LevelSpec(
@@ -75,14 +133,13 @@ class DunSpec:
                 extra = level.get("extra", {}),
             )
             filepaths = level["textures"]
-            textures[level_specs[name]] = paths_to_patterns(
+            texture_paths[level_specs[name]] = TexturePaths(
                 Path(filepaths["background"]).absolute(),
                 Path(filepaths["room"]).absolute(),
                 Path(filepaths["hallway"]).absolute(),
                 Path(filepaths["room_wall"]).absolute(),
                 Path(filepaths["hall_wall"]).absolute(),
                 Path(filepaths["water"]).absolute(),
-                scale_factor,
                 filepaths.get("background_grid", False),
                 filepaths.get("room_grid", True),
                 filepaths.get("hall_grid", True),
@@ -91,7 +148,8 @@ class DunSpec:
         return DunSpec(
             level_count = spec["floor_count"],
             levels = list(level_specs.values()),
-            textures = textures,
+            textures = LevelTextures(texture_paths, scale_factor),
             scale = scale_factor,
             entrances = spec.get("entrances", None),
+            seed = spec.get("seed", None),
         )
@@ -0,0 +1,168 @@
+import math
+import numpy as np
+import svg
+
+from collections import defaultdict
+from copy import copy
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from .drawing import find_element, replace_element
+from .geometry import Bounds, ShapeBatch, ShapeGroup
+
+# Layers of Use elements that reference the shapes of the floor
+SHAPE_LAYERS = ("hall_walls", "room_walls", "hallways", "rooms")
+# The water filter displaces mask elements by up to this much
+WATER_PAD = 35
+# Cells along the longer side of the floor
+GRID_CELLS = 64
+
+
+@dataclass
+class TileItem:
+    """An element of a floor sent as part of a tile. Items are added to
+    the element with id parent, in order, and key tells repeats apart."""
+    key: str
+    parent: str
+    order: int
+    text: str
+
+
+class FloorIndex:
+    """A uniform grid index over the room, hallway, stamp and water mask
+    elements of a floor, so a viewer can fetch only the elements in view.
+
+    The rest of the floor (patterns, background, lower floors) is small or
+    needed everywhere, and is sent whole as the skeleton."""
+
+    def __init__(self, img: svg.SVG):
+        shapes = find_element(img, "shapes")
+        if not isinstance(shapes, ShapeGroup) or shapes.shapes is None:
+            raise Exception("Only floors with batched shapes can be indexed.")
+        self.img = img
+        self.batch: ShapeBatch = shapes.shapes
+        shape_bounds = self.batch.bounds()
+        prefix = f"#{self.batch.prefix}-"
+
+        self.items: List[Tuple[str, int, svg.Element]] = []
+        # Index of the shape each item draws, or -1
+        self.item_shapes: List[int] = []
+        bounds: List[Bounds] = []
+
+        def add(parent: str, order: int, el: svg.Element, box: Bounds, shape: int = -1):
+            self.items.append((parent, order, el))
+            self.item_shapes.append(shape)
+            bounds.append(box)
+
+        for layer_id in SHAPE_LAYERS:
+            layer = find_element(img, layer_id)
+            for order, el in enumerate((layer.elements or []) if layer is not None else []):
+                href = getattr(el, "href", None)
+                if not isinstance(href, str) or not href.startswith(prefix):
+                    continue
+                shape = int(href[len(prefix):])
+                pad = float(getattr(el, "stroke_width", None) or 0) / 2
+                x0, y0, x1, y1 = shape_bounds[shape].tolist()
+                add(layer_id, order, el, (x0 - pad, y0 - pad, x1 + pad, y1 + pad), shape)
+
+        stamps = find_element(img, "stamps")
+        for order, el in enumerate((stamps.elements or []) if stamps is not None else []):
+            x, y = float(getattr(el, "x", 0) or 0), float(getattr(el, "y", 0) or 0)
+            w, h = float(getattr(el, "width", 0) or 0), float(getattr(el, "height", 0) or 0)
+            # Stamps may be rotated about their center
+            r = math.hypot(w, h) / 2
+            add("stamps", order, el, (x + w / 2 - r, y + h / 2 - r, x + w / 2 + r, y + h / 2 + r))
+
+        mask = find_element(img, "water_mask")
+        for order, el in enumerate((mask.elements or []) if mask is not None else []):
+            if "mask-element" not in (getattr(el, "class_", None) or []):
+                continue
+            if isinstance(el, svg.Circle):
+                cx, cy, r = float(el.cx or 0), float(el.cy or 0), float(el.r or 0) # type: ignore[arg-type]
+                box = (cx - r, cy - r, cx + r, cy + r)
+            else:
+                x, y = float(getattr(el, "x", 0) or 0), float(getattr(el, "y", 0) or 0)
+                box = (x, y, x + float(getattr(el, "width", 0) or 0), y + float(getattr(el, "height", 0) or 0))
+            add("water_mask", order, el, (
+                box[0] - WATER_PAD, box[1] - WATER_PAD, box[2] + WATER_PAD, box[3] + WATER_PAD,
+            ))
+
+        self.bounds = np.array(bounds, dtype = np.float64).reshape(-1, 4)
+        width = float(img.width or 1) # type: ignore[arg-type]
+        height = float(img.height or 1) # type: ignore[arg-type]
+        self.cell = max(width, height, 1) / GRID_CELLS
+        self.cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        # Items without finite bounds are part of every tile
+        self.everywhere: List[int] = []
+        # Cells that hold items, as (cx0, cy0, cx1, cy1)
+        self.cell_extent = (0, 0, -1, -1)
+        for i, (x0, y0, x1, y1) in enumerate(self.bounds.tolist()):
+            if not all(math.isfinite(v) for v in (x0, y0, x1, y1)):
+                self.everywhere.append(i)
+                continue
+            for cx in range(int(x0 // self.cell), int(x1 // self.cell) + 1):
+                for cy in range(int(y0 // self.cell), int(y1 // self.cell) + 1):
+                    self.cells[(cx, cy)].append(i)
+        if self.cells:
+            cxs, cys = zip(*self.cells)
+            self.cell_extent = (min(cxs), min(cys), max(cxs), max(cys))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def query(self, x0: float, y0: float, x1: float, y1: float, zoom: float = 0, min_px: float = 1) -> List[TileItem]:
+        """Returns the items overlapping the box, and the shapes they use.
+        At a zoom of zoom screen pixels per unit, items smaller than min_px
+        pixels are left out; a zoom of 0 keeps everything."""
+        found: List[int] = list(self.everywhere)
+        ex0, ey0, ex1, ey1 = self.cell_extent
+        for cx in range(max(int(x0 // self.cell), ex0), min(int(x1 // self.cell), ex1) + 1):
+            for cy in range(max(int(y0 // self.cell), ey0), min(int(y1 // self.cell), ey1) + 1):
+                found += self.cells.get((cx, cy), ())
+        if not found:
+            return []
+        idx = np.unique(np.array(found, dtype = np.int64))
+        b = self.bounds[idx]
+        hit = (b[:, 0] <= x1) & (x0 <= b[:, 2]) & (b[:, 1] <= y1) & (y0 <= b[:, 3])
+        if zoom > 0:
+            with np.errstate(invalid = "ignore"):
+                size = np.maximum(b[:, 2] - b[:, 0], b[:, 3] - b[:, 1]) * zoom
+            hit &= ~np.isfinite(size) | (size >= min_px)
+
+        items: List[TileItem] = []
+        shapes = set()
+        for i in idx[hit].tolist():
+            parent, order, el = self.items[i]
+            items.append(TileItem(f"{parent}:{order}", parent, order, str(el)))
+            if self.item_shapes[i] >= 0:
+                shapes.add(self.item_shapes[i])
+        items += [
+            TileItem(self.batch.id(s), "shapes", s, self.batch.shape_text(s)) for s in sorted(shapes)
+        ]
+        return items
+
+    def skeleton(self) -> svg.SVG:
+        """Returns a copy of the floor without the indexed elements, to be
+        filled in tile by tile."""
+        def empty(el: svg.Element) -> svg.Element:
+            el_copy = copy(el)
+            el_copy.elements = []
+            return el_copy
+
+        def unmasked(el: svg.Element) -> svg.Element:
+            el_copy = copy(el)
+            el_copy.elements = [
+                e for e in el.elements or [] if "mask-element" not in (getattr(e, "class_", None) or [])
+            ]
+            return el_copy
+
+        def no_shapes(el: svg.Element) -> svg.Element:
+            el_copy = copy(el)
+            el_copy.shapes = ShapeBatch(self.batch.prefix, self.batch.precision) # type: ignore[attr-defined]
+            return el_copy
+
+        img = self.img
+        for layer_id in SHAPE_LAYERS + ("stamps",):
+            img = replace_element(img, layer_id, empty)
+        img = replace_element(img, "water_mask", unmasked)
+        return replace_element(img, "shapes", no_shapes)
@@ -0,0 +1,135 @@
+import math
+import svg
+
+from collections import defaultdict
+from copy import copy
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from .drawing import replace_element
+from .geometry import ShapeBatch, ShapeGroup
+
+# Flat colours drawn in place of the texture patterns at low detail
+FLAT_FILLS = {
+    "background_pattern": "#262626",
+    "room_pattern": "#b8a98c",
+    "hallway_pattern": "#a4967c",
+    "room_wall_pattern": "#4d4d4d",
+    "hall_wall_pattern": "#4d4d4d",
+    "water_pattern": "#35648f",
+    "room_top_pattern": "#6e6e6e",
+}
+# Layers holding the hallways of a floor
+HALL_LAYERS = ("hall_walls", "hallways")
+
+
+@dataclass(frozen=True)
+class DetailLevel:
+    """How a floor is drawn at one level of detail."""
+    # Smallest size on screen of a tile, in pixels, to show this level at
+    min_tile_px: float
+    # Distance in tiles that paths may move when simplified
+    tolerance: float = 0.0
+    # Draw flat colours in place of textures
+    flat_fills: bool = False
+    # Draw the hallways within squares this many tiles wide as one path,
+    # or leave them be if 0. Merged paths can still be loaded as tiles.
+    merge_cell: int = 0
+
+# From most to least detailed. Paths are simplified to within about a
+# pixel, and hallways merged within about a view tile, at the largest
+# zoom each level is shown at.
+DETAIL_LEVELS = (
+    DetailLevel(16),
+    DetailLevel(4, tolerance = 1 / 16, merge_cell = 32),
+    DetailLevel(0, tolerance = 1 / 4, flat_fills = True, merge_cell = 128),
+)
+
+def _merge_hallways(layer: svg.Element, batch: ShapeBatch, cell: float, merged: Dict[Tuple[int, ...], int]) -> svg.Element:
+    # Replaces the hallways of a layer with one use of a merged path per
+    # style and square. Other elements keep their place.
+    prefix = f"#{batch.prefix}-"
+    groups: Dict[Tuple, List[Tuple[svg.Element, int]]] = defaultdict(list)
+    elements: List[Optional[svg.Element]] = []
+    for el in layer.elements or []:
+        href = getattr(el, "href", None)
+        if "hall" not in (getattr(el, "class_", None) or []) or not isinstance(href, str) or not href.startswith(prefix):
+            elements.append(el)
+            continue
+        shape = int(href[len(prefix):])
+        x0, y0, x1, y1 = batch.shape_bounds(shape)
+        square = (
+            int(((x0 + x1) / 2) // cell), int(((y0 + y1) / 2) // cell)
+        ) if all(math.isfinite(v) for v in (x0, y0, x1, y1)) else None
+        key = (
+            getattr(el, "fill", None), getattr(el, "stroke", None),
+            getattr(el, "stroke_width", None), tuple(getattr(el, "class_", None) or []), square,
+        )
+        if key not in groups:
+            # Holds the place of the merged hallway
+            elements.append(None)
+        groups[key].append((el, shape))
+
+    placeholders = iter(groups.values())
+    out: List[svg.Element] = []
+    for kept in elements:
+        if kept is not None:
+            out.append(kept)
+            continue
+        group = next(placeholders)
+        shapes = tuple(shape for _, shape in group)
+        if shapes not in merged:
+            merged[shapes] = batch.merge(list(shapes))
+        use = copy(group[0][0])
+        use.href = f"{prefix}{merged[shapes]}" # type: ignore[attr-defined]
+        out.append(use)
+    layer_copy = copy(layer)
+    layer_copy.elements = out
+    return layer_copy
+
+def _flatten_fills(el: svg.Element) -> svg.Element:
+    # Returns a copy of el and its children with textures swapped for
+    # flat colours, dropping the texture patterns
+    el_copy = copy(el)
+    for attr in ("fill", "stroke"):
+        value = getattr(el, attr, None)
+        if isinstance(value, str) and value.startswith("url(#") and value[5:-1] in FLAT_FILLS:
+            setattr(el_copy, attr, FLAT_FILLS[value[5:-1]])
+    if el.elements:
+        el_copy.elements = [
+            _flatten_fills(child) for child in el.elements
+            if not (isinstance(child, svg.Pattern) and child.id in FLAT_FILLS)
+        ]
+    return el_copy
+
+def draw_detail(img: svg.SVG, level: DetailLevel, scale: int) -> svg.SVG:
+    """Returns a copy of a floor drawn at a level of detail, or img itself
+    if the level leaves out nothing. img is left unchanged."""
+    if level.tolerance <= 0 and not level.flat_fills and level.merge_cell <= 0:
+        return img
+
+    batches: Dict[Optional[str], ShapeBatch] = {}
+    def simplify_shapes(defs: svg.Element) -> svg.Element:
+        defs_copy = copy(defs)
+        defs_copy.elements = []
+        for el in defs.elements or []:
+            if isinstance(el, ShapeGroup) and el.shapes is not None:
+                shapes = el.shapes.simplified(level.tolerance * scale)
+                el = copy(el)
+                el.shapes = batches[el.id] = shapes
+            defs_copy.elements.append(el)
+        return defs_copy
+    img = replace_element(img, "defs", simplify_shapes)
+
+    batch = batches.get("shapes")
+    if level.merge_cell > 0 and batch is not None:
+        merged: Dict[Tuple[int, ...], int] = {}
+        for layer_id in HALL_LAYERS:
+            img = replace_element(
+                img, layer_id, lambda layer: _merge_hallways(layer, batch, level.merge_cell * scale, merged),
+            )
+        batch.drop([shape for shapes in merged for shape in shapes])
+
+    if level.flat_fills:
+        img = _flatten_fills(img) # type: ignore[assignment]
+    return img
@@ -0,0 +1,342 @@
+import math
+import numpy as np
+import svg
+
+from copy import copy
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple, cast
+
+# Kinds of shapes held in a ShapeBatch
+RECT = 0
+CIRCLE = 1
+POLYLINE = 2
+PATH = 3
+
+Style = Tuple[Tuple[str, str], ...]
+Bounds = Tuple[float, float, float, float]
+
+_NO_BOUNDS: Bounds = (-math.inf, -math.inf, math.inf, math.inf)
+
+# Decimal places kept in path coordinates
+PATH_PRECISION = 2
+
+def _format_fixed(values: List[int], precision: int) -> List[str]:
+    # Writes integers counting units of 10^-precision as short decimals
+    if precision <= 0:
+        return [str(v) for v in values]
+    div = 10 ** precision
+    return [f"{v / div:.{precision}f}".rstrip("0").rstrip(".") for v in values]
+
+def encode_path(points: np.ndarray, closed: bool = False, precision: int = PATH_PRECISION) -> str:
+    """Encodes an (n, 2) array of points as path data: a move to the first
+    point followed by relative l commands, with coordinates rounded to
+    precision decimal places. Steps that round to nothing are dropped."""
+    if len(points) == 0:
+        return ""
+    fixed = np.rint(np.asarray(points, dtype = np.float64) * 10 ** precision).astype(np.int64)
+    steps = np.diff(fixed, axis = 0)
+    steps = steps[np.any(steps != 0, axis = 1)]
+    start = _format_fixed(fixed[0].tolist(), precision)
+    d = f"M {start[0]} {start[1]}"
+    if len(steps):
+        d += " l " + " ".join(_format_fixed(steps.ravel().tolist(), precision))
+    return d + " Z" if closed else d
+
+# Spans of a polyline shorter than this are simplified in plain Python,
+# where NumPy's per call overhead outweighs its speed
+_SIMPLIFY_NUMPY_SPAN = 64
+
+def _farthest(points: np.ndarray, xs: List[float], ys: List[float], a: int, b: int) -> Tuple[int, float]:
+    # Returns the point between a and b farthest from the chord a-b, and
+    # its distance times the chord length (or its distance, if a and b meet)
+    ax, ay = xs[a], ys[a]
+    cx, cy = xs[b] - ax, ys[b] - ay
+    length = math.hypot(cx, cy)
+    if b - a > _SIMPLIFY_NUMPY_SPAN:
+        rel = points[a + 1:b] - points[a]
+        if length > 0:
+            dist = np.abs(cx * rel[:, 1] - cy * rel[:, 0])
+        else:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        i = int(np.argmax(dist))
+        return (a + 1 + i, float(dist[i]))
+    if length > 0:
+        dists = [abs(cx * (y - ay) - cy * (x - ax)) for x, y in zip(xs[a + 1:b], ys[a + 1:b])]
+    else:
+        dists = [math.hypot(x - ax, y - ay) for x, y in zip(xs[a + 1:b], ys[a + 1:b])]
+    best = max(dists)
+    return (a + 1 + dists.index(best), best)
+
+def simplify_path(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Simplifies a polyline with the Ramer-Douglas-Peucker algorithm,
+    dropping points that lie within tolerance of the line between the
+    points kept on either side. The end points are always kept."""
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    xs, ys = points[:, 0].tolist(), points[:, 1].tolist()
+    keep = [0, len(points) - 1]
+    spans = [(0, len(points) - 1)]
+    while spans:
+        a, b = spans.pop()
+        if b - a < 2:
+            continue
+        m, dist = _farthest(points, xs, ys, a, b)
+        length = math.hypot(xs[b] - xs[a], ys[b] - ys[a])
+        if dist > tolerance * (length if length > 0 else 1):
+            keep.append(m)
+            spans.append((a, m))
+            spans.append((m, b))
+    return points[sorted(keep)]
+
+
+class ShapeBatch:
+    """Compact geometry of the shapes drawn for a floor.
+
+    Shapes are kept as numeric arrays (rects, circles, polylines) plus a
+    small table of shared styles, instead of one svg.py element per shape.
+    The batch serializes straight to SVG text, and only builds svg.py
+    elements when asked to. Shape i gets the id `<prefix>-<i>`. Polylines
+    are written with precision decimal places, and those added with
+    simplify set are simplified to within tolerance drawing units."""
+
+    def __init__(self, prefix: str, precision: int = PATH_PRECISION, tolerance: float = 0.0):
+        self.prefix = prefix
+        self.precision = precision
+        self.tolerance = tolerance
+        # Points in simplified polylines before and after simplification
+        self.points_before = 0
+        self.points_after = 0
+        self.kinds: List[int] = []
+        self.rows: List[int] = []
+        self.style_ids: List[int] = []
+        self.styles: List[Style] = []
+        self._style_index: Dict[Style, int] = {}
+        self.rects: List[Tuple[Any, Any, Any, Any]] = []
+        self.circles: List[Tuple[Any, Any, Any]] = []
+        self.points: List[np.ndarray] = []
+        self.closed: List[bool] = []
+        self.paths: List[str] = []
+        # Bounds of raw paths, where known
+        self.path_bounds: List[Optional[Bounds]] = []
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Polylines are pickled as one array, which is far smaller and
+        # faster to load than many small ones
+        state = self.__dict__.copy()
+        state["points"] = np.concatenate(self.points) if self.points else np.empty((0, 2))
+        state["point_counts"] = np.array([len(p) for p in self.points], dtype = np.int64)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        counts = state.pop("point_counts")
+        state.setdefault("precision", PATH_PRECISION)
+        state.setdefault("tolerance", 0.0)
+        state.setdefault("points_before", 0)
+        state.setdefault("points_after", 0)
+        state.setdefault("path_bounds", [None] * len(state["paths"]))
+        state["points"] = np.split(state["points"], np.cumsum(counts)[:-1]) if len(counts) else []
+        self.__dict__.update(state)
+
+    def id(self, i: int) -> str:
+        return f"{self.prefix}-{i}"
+
+    def _add(self, kind: int, row: int, style: Dict[str, str]) -> int:
+        key = tuple(sorted(style.items()))
+        if key not in self._style_index:
+            self._style_index[key] = len(self.styles)
+            self.styles.append(key)
+        self.kinds.append(kind)
+        self.rows.append(row)
+        self.style_ids.append(self._style_index[key])
+        return len(self.kinds) - 1
+
+    def add_rect(self, x: Any, y: Any, width: Any, height: Any, **style: str) -> int:
+        """Adds a rectangle, returning its index. Style keywords are SVG
+        attribute names with dashes written as underscores."""
+        self.rects.append((x, y, width, height))
+        return self._add(RECT, len(self.rects) - 1, style)
+
+    def add_circle(self, cx: Any, cy: Any, r: Any, **style: str) -> int:
+        """Adds a circle, returning its index."""
+        self.circles.append((cx, cy, r))
+        return self._add(CIRCLE, len(self.circles) - 1, style)
+
+    def add_polyline(self, points: Any, closed: bool = False, simplify: bool = False, **style: str) -> int:
+        """Adds a path through an (n, 2) array of points, returning its
+        index. Closed polylines end with a Z command."""
+        points = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+        if simplify and self.tolerance > 0:
+            self.points_before += len(points)
+            points = simplify_path(points, self.tolerance)
+            self.points_after += len(points)
+        self.points.append(points)
+        self.closed.append(closed)
+        return self._add(POLYLINE, len(self.points) - 1, style)
+
+    def add_path(self, d: str, bounds: Optional[Bounds] = None, **style: str) -> int:
+        """Adds a path from raw path data, returning its index. Paths are
+        not parsed, so their bounds are unknown unless given."""
+        self.paths.append(d)
+        self.path_bounds.append(bounds)
+        return self._add(PATH, len(self.paths) - 1, style)
+
+    def add_element(self, el: svg.Element) -> int:
+        """Adds the geometry and shared styling of an svg.py rect, circle or
+        path element, returning its index."""
+        style = {
+            k: str(v) for k, v in (
+                ("paint_order", getattr(el, "paint_order", None)),
+                ("stroke_linejoin", getattr(el, "stroke_linejoin", None)),
+            ) if v is not None
+        }
+        if isinstance(el, svg.Rect):
+            return self.add_rect(el.x, el.y, el.width, el.height, **style)
+        if isinstance(el, svg.Circle):
+            return self.add_circle(el.cx, el.cy, el.r, **style)
+        if isinstance(el, svg.Path):
+            return self.add_path(str(el.as_dict().get("d", "")), None, **style)
+        raise Exception(f"Cannot add {el.element_name} elements to a shape batch.")
+
+    def path_data(self, row: int) -> str:
+        """Returns the path data of a polyline."""
+        return encode_path(self.points[row], self.closed[row], self.precision)
+
+    def shape_bounds(self, i: int) -> Bounds:
+        """Returns the (x0, y0, x1, y1) bounding box of shape i, which is
+        infinite for raw paths of unknown bounds."""
+        kind, row = self.kinds[i], self.rows[i]
+        if kind == RECT:
+            x, y, w, h = (float(v) for v in self.rects[row])
+            return (x, y, x + w, y + h)
+        if kind == CIRCLE:
+            cx, cy, r = (float(v) for v in self.circles[row])
+            return (cx - r, cy - r, cx + r, cy + r)
+        if kind == POLYLINE and len(self.points[row]):
+            x0, y0 = self.points[row].min(axis = 0).tolist()
+            x1, y1 = self.points[row].max(axis = 0).tolist()
+            return (x0, y0, x1, y1)
+        if kind == PATH and self.path_bounds[row] is not None:
+            return cast(Bounds, self.path_bounds[row])
+        return _NO_BOUNDS
+
+    def bounds(self) -> np.ndarray:
+        """Returns the bounding box of every shape as an (n, 4) array."""
+        return np.array([self.shape_bounds(i) for i in range(len(self))], dtype = np.float64).reshape(-1, 4)
+
+    def outline(self, i: int) -> str:
+        """Returns path data drawing shape i, whatever its kind."""
+        kind, row = self.kinds[i], self.rows[i]
+        if kind == RECT:
+            x, y, w, h = (float(v) for v in self.rects[row])
+            return encode_path(np.array([(x, y), (x + w, y), (x + w, y + h), (x, y + h)]), True, self.precision)
+        if kind == CIRCLE:
+            cx, cy, r = (float(v) for v in self.circles[row])
+            fixed = np.rint(np.array([cx - r, cy, r, 2 * r]) * 10 ** self.precision).astype(np.int64)
+            mx, my, rs, ds = _format_fixed(fixed.tolist(), self.precision)
+            return f"M {mx} {my} a {rs} {rs} 0 1 0 {ds} 0 a {rs} {rs} 0 1 0 -{ds} 0 Z"
+        return self.path_data(row) if kind == POLYLINE else self.paths[row]
+
+    def merge(self, indices: List[int]) -> int:
+        """Adds a single path drawing the shapes at indices, styled like
+        the first of them, returning its index."""
+        bounds = np.array([self.shape_bounds(i) for i in indices], dtype = np.float64)
+        return self.add_path(
+            " ".join(self.outline(i) for i in indices),
+            (*bounds[:, :2].min(axis = 0).tolist(), *bounds[:, 2:].max(axis = 0).tolist()),
+            **dict(self.styles[self.style_ids[indices[0]]]),
+        )
+
+    def drop(self, indices: List[int]):
+        """Empties the shapes at indices. The other shapes keep their ids."""
+        for i in indices:
+            self.kinds[i] = PATH
+            self.rows[i] = len(self.paths)
+            self.paths.append("")
+            self.path_bounds.append(None)
+
+    def simplified(self, tolerance: float) -> "ShapeBatch":
+        """Returns a copy of the batch with every polyline simplified to
+        within tolerance drawing units. Shapes keep their ids."""
+        batch = copy(self)
+        for name in ("kinds", "rows", "style_ids", "styles", "rects", "circles", "closed", "paths", "path_bounds"):
+            setattr(batch, name, list(getattr(self, name)))
+        batch._style_index = dict(self._style_index)
+        batch.points = [simplify_path(points, tolerance) for points in self.points]
+        return batch
+
+    def _style_attrs(self, i: int) -> str:
+        return "".join(
+            f' {k.replace("_", "-")}="{v}"' for k, v in self.styles[self.style_ids[i]]
+        )
+
+    def shape_text(self, i: int) -> str:
+        """Returns the SVG text of shape i."""
+        kind, row = self.kinds[i], self.rows[i]
+        attrs = f'id="{self.id(i)}"'
+        if kind == RECT:
+            x, y, w, h = self.rects[row]
+            return f'<rect {attrs} x="{x}" y="{y}" width="{w}" height="{h}"{self._style_attrs(i)}/>'
+        if kind == CIRCLE:
+            cx, cy, r = self.circles[row]
+            return f'<circle {attrs} cx="{cx}" cy="{cy}" r="{r}"{self._style_attrs(i)}/>'
+        d = self.path_data(row) if kind == POLYLINE else self.paths[row]
+        return f'<path {attrs} d="{d}"{self._style_attrs(i)}/>'
+
+    def iter_text(self) -> Iterator[str]:
+        """Yields the SVG text of each shape in turn."""
+        for i in range(len(self)):
+            yield self.shape_text(i)
+
+    def to_text(self) -> str:
+        """Returns the SVG text of every shape."""
+        return "".join(self.iter_text())
+
+    def to_elements(self) -> List[svg.Element]:
+        """Builds svg.py elements for every shape."""
+        elements: List[svg.Element] = []
+        for i in range(len(self)):
+            kind, row = self.kinds[i], self.rows[i]
+            style = dict(self.styles[self.style_ids[i]])
+            el: svg.Element
+            if kind == RECT:
+                x, y, w, h = self.rects[row]
+                el = svg.Rect(x = x, y = y, width = w, height = h)
+            elif kind == CIRCLE:
+                cx, cy, r = self.circles[row]
+                el = svg.Circle(cx = cx, cy = cy, r = r)
+            else:
+                d = self.path_data(row) if kind == POLYLINE else self.paths[row]
+                el = svg.Path(d = d) # type: ignore[arg-type]
+            el.id = self.id(i)
+            for k, v in style.items():
+                setattr(el, k, v)
+            elements.append(el)
+        return elements
+
+
+@dataclass
+class ShapeGroup(svg.G):
+    """A group whose children are held in a ShapeBatch and written out
+    directly as text. Call expand before editing the children."""
+    shapes: Optional[ShapeBatch] = None
+
+    def expand(self):
+        """Replaces the batch with svg.py elements that can be edited."""
+        if self.shapes is not None:
+            self.elements = self.shapes.to_elements()
+            self.shapes = None
+
+    def iter_str(self) -> Iterator[str]:
+        """Yields the SVG text of the group a shape at a time."""
+        if self.shapes is None:
+            yield super().as_str()
+            return
+        yield f'<g id="{self.id}">' if self.id is not None else "<g>"
+        yield from self.shapes.iter_text()
+        yield "</g>"
+
+    def as_str(self) -> str:
+        return "".join(self.iter_str())
@@ -1,9 +1,12 @@
-import random
+from random import Random
 from typing import List, Optional
+from uuid import UUID
 
+from . import profiling
 from .connections import Connections
-from .rooms import Point, Stairs
-from .room_generators import LevelSpec, RoomFactory
+from .rooms import Point, Room, Stairs
+from .room_generators import LevelSpec, RoomBatch
+from .room_table import RoomTable
 
 class Level:
     """A level is a collection of rooms and hallways."""
@@ -13,14 +16,47 @@ class Level:
         spec: LevelSpec,
         up: List[Point],
         towers: bool,
+        rng: Optional[Random] = None,
     ):
+        if rng is None:
+            rng = Random()
         self.width = spec.width
         self.height = spec.height
 
         # Create rooms and hallways
-        self.rooms = tuple(RoomFactory(spec, up, towers))
-        self.hallways = Connections(self.rooms)
-        self.hallways.prune(spec.hall_density)
+        with profiling.stage("rooms", room_alg = spec.room_alg):
+            self.rooms = RoomBatch(spec, up, towers, rng)
+        self._room_index = {UUID(bytes = bytes(b)): i for i, b in enumerate(self.rooms.ids)}
+        with profiling.stage("connections"):
+            self.hallways = Connections(
+                self.rooms,
+                candidates = spec.extra.get("hall_candidates", "complete"),
+                neighbors = spec.extra.get("hall_neighbors", 8),
+            )
+        with profiling.stage("prune"):
+            self.hallways.prune(spec.hall_density, rng)
+
+    @classmethod
+    def from_parts(
+        cls,
+        width: int,
+        height: int,
+        rooms: RoomTable,
+        hallways: Connections,
+    ) -> "Level":
+        """Creates a level from rooms and hallways that were already
+        generated, such as the stitched tiles of a large floor."""
+        level = cls.__new__(cls)
+        level.width = width
+        level.height = height
+        level.rooms = rooms
+        level._room_index = {UUID(bytes = bytes(b)): i for i, b in enumerate(rooms.ids)}
+        level.hallways = hallways
+        return level
+
+    def index(self, room: Room) -> int:
+        """Returns the position of room in self.rooms."""
+        return self._room_index[room.id]
 
     def __repr__(self) -> str:
         s = f"Level: {self.width}x{self.height} ({len(self.rooms)} rooms)\n"
@@ -40,10 +76,10 @@ class Level:
                 status[4] = 'U'
             elif room.stairs == Stairs.DOWN:
                 status[4] ='D'
-            doors = len(self.hallways.room_hallways(room))
+            doors = self.hallways.degree(room)
             s += f"  Room {rc:3} [{''.join(status)}] {doors} {room.id}\n"
         for hallway in self.hallways:
-            r1 = self.rooms.index(hallway.room1) + 1
-            r2 = self.rooms.index(hallway.room2) + 1
+            r1 = self.index(hallway.room1) + 1
+            r2 = self.index(hallway.room2) + 1
             s += f"    Room {r1:3} -- Room {r2:3}\n"
         return s
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import pickle
+import svg
+import tempfile
+
+from dataclasses import asdict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .rooms import Point
+from .room_generators import LevelSpec
+
+# Bump when generation or drawing changes in a way that makes cached
+# levels stale.
+CACHE_VERSION = 4
+
+
+class LevelCache:
+    """A content addressed store of finished levels.
+
+    Levels are stored under a key built from everything that determines
+    them: the level spec, the seed, the texture hash, the scale and the
+    stairs the level starts from. Rerunning with a tweaked spec only has to
+    regenerate the levels whose inputs changed (and those below them, whose
+    stairs move)."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents = True, exist_ok = True)
+
+    @staticmethod
+    def key(
+        spec: LevelSpec,
+        texture_hash: str,
+        level_number: int,
+        entrances: List[Point],
+        bottom_level: bool,
+        seed: int,
+        scale: int,
+    ) -> str:
+        """Returns the cache key of a level."""
+        inputs = {
+            "version": CACHE_VERSION,
+            "spec": asdict(spec),
+            "textures": texture_hash,
+            "level": level_number,
+            "entrances": [(p.x, p.y) for p in entrances],
+            "bottom": bottom_level,
+            "seed": seed,
+            "scale": scale,
+        }
+        text = json.dumps(inputs, sort_keys = True, default = str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.pkl"
+
+    def get(self, key: str) -> Optional[Tuple[List[Point], List[svg.SVG]]]:
+        """Returns the stairs down and floors of a cached level, or None if
+        the level is not cached or its entry cannot be read, such as one
+        pickled from classes that have since changed."""
+        try:
+            with self._path(key).open("rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def put(self, key: str, stairs_down: List[Point], imgs: List[svg.SVG]):
+        """Stores a level. Entries are written to a temporary file first so
+        an interrupted run never leaves a partial entry behind."""
+        path = self._path(key)
+        path.parent.mkdir(exist_ok = True)
+        fd, tmp = tempfile.mkstemp(dir = path.parent, suffix = ".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((stairs_down, imgs), f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
@@ -1,16 +1,20 @@
 import svg
 
 from abc import ABC, abstractmethod
+from copy import copy
 from dataclasses import dataclass
 from pathlib import Path
 import base64
+import hashlib
 import mimetypes
-from random import Random, random
-from typing import Collection, List, Optional
+from random import Random
+from typing import Callable, Collection, Dict, List, Optional, Tuple, cast
 from urllib.parse import quote
 
+from . import profiling
 from .connections import Connections, Hallway
-from .drawing import append_children, find_element, remove_children, strip_ids
+from .drawing import append_children, find_element, remove_children, replace_element, strip_ids
+from .geometry import PATH_PRECISION, ShapeBatch, ShapeGroup
 from .level import Level
 from .rooms import Room
 
@@ -26,6 +30,9 @@ class FillPatterns:
 class LevelDrawer(ABC):
     """A LevelDrawer implements svg drawing for rooms and hallways."""
 
+    # Width of the walls around rooms, in tiles
+    room_wall_width = 1
+
     @classmethod
     def draw_level(
         cls,
@@ -34,10 +41,13 @@ class LevelDrawer(ABC):
         scale: int = 1,
         hall_width: int = 1,
         walls_in_fg: bool = False,
+        rng: Optional[Random] = None,
+        path_precision: int = PATH_PRECISION,
+        path_tolerance: float = 0.0,
     ) -> svg.SVG:
         width = level.width * scale
         height = level.height * scale
-        rng_seed = random()
+        rng_seed = (rng if rng is not None else Random()).random()
 
         defs: List[svg.Element] = [
             svg.Pattern(
@@ -119,48 +129,70 @@ class LevelDrawer(ABC):
                 id = "background",
             ),
         ]
+        # Rooms and hallways are drawn once into the defs. The wall and
+        # fill layers reference the same shapes, styled differently.
+        shapes = ShapeBatch(
+            f"s{Random(rng_seed).getrandbits(32):08x}",
+            path_precision,
+            path_tolerance * scale,
+        )
+        hall_rng = Random(rng_seed)
+        hall_ids = [
+            shapes.id(cls.shape_hallway(shapes, h, scale, hall_width, hall_rng))
+            for h in sorted(level.hallways, reverse = True)
+        ]
+        room_rng = Random(rng_seed)
+        room_ids = [shapes.id(cls.shape_room(shapes, r, scale, room_rng)) for r in level.rooms]
+        room_wall_width = scale * cls.room_wall_width
+        defs.append(ShapeGroup(shapes = shapes, id = "shapes"))
+
         walls: List[svg.Element] = [
             svg.G(
-                elements = cls.draw_hallways(
-                    level.hallways,
-                    scale,
-                    "url(#hall_wall_pattern)",
-                    hall_width + 1,
-                    Random(rng_seed),
-                ),
+                elements = [
+                    svg.Use(
+                        href = f"#{hall_id}",
+                        fill = "transparent",
+                        stroke = "url(#hall_wall_pattern)",
+                        stroke_width = scale * (hall_width + 1),
+                        class_ = ["hall"],
+                    ) for hall_id in hall_ids
+                ],
                 id = "hall_walls",
             ),
             svg.G(
-                elements = cls.draw_rooms(
-                    level.rooms,
-                    scale,
-                    "none",
-                    "url(#room_wall_pattern)",
-                    Random(rng_seed),
-                ),
+                elements = [
+                    svg.Use(
+                        href = f"#{room_id}",
+                        fill = "none",
+                        stroke = "url(#room_wall_pattern)",
+                        stroke_width = room_wall_width,
+                    ) for room_id in room_ids
+                ],
                 id = "room_walls",
             ),
         ]
         fg: List[svg.Element] = [
             svg.G(
-                elements = cls.draw_hallways(
-                    level.hallways,
-                    scale,
-                    "url(#hallway_pattern)",
-                    hall_width,
-                    Random(rng_seed),
-                ),
+                elements = [
+                    svg.Use(
+                        href = f"#{hall_id}",
+                        fill = "transparent",
+                        stroke = "url(#hallway_pattern)",
+                        stroke_width = scale * hall_width,
+                        class_ = ["hall"],
+                    ) for hall_id in hall_ids
+                ],
                 id = "hallways",
             ),
             svg.G(
-                elements = cls.draw_rooms(
-                    level.rooms,
-                    scale,
-                    "url(#room_pattern)",
-                    "none",
-                    Random(rng_seed),
-                    set_ids = True,
-                ),
+                elements = cls.tag_rooms(level.rooms, [
+                    svg.Use(
+                        href = f"#{room_id}",
+                        fill = "url(#room_pattern)",
+                        stroke = "none",
+                        stroke_width = room_wall_width,
+                    ) for room_id in room_ids
+                ]),
                 id = "rooms",
             ),
             svg.G(
@@ -207,23 +239,41 @@ class LevelDrawer(ABC):
     ) -> svg.Element:
         ...
 
+    @classmethod
+    def shape_room(cls, shapes: ShapeBatch, room: Room, scale: int, rng: Random) -> int:
+        """Adds the outline of a room to shapes, returning its index. The
+        default goes through draw_room, drawers override this to add their
+        geometry directly."""
+        return shapes.add_element(cls.draw_room(room, scale, "none", "none", rng))
+
+    @classmethod
+    def shape_hallway(
+        cls, shapes: ShapeBatch, hallway: Hallway, scale: int, width: int, rng: Random
+    ) -> int:
+        """Adds the path of a hallway to shapes, returning its index."""
+        return shapes.add_element(cls.draw_hallway(hallway, scale, "none", width, rng))
+
+    @staticmethod
+    def tag_rooms(rooms: Collection[Room], elements: List[svg.Element]) -> List[svg.Element]:
+        """Sets the id, classes and notes of each room on its element."""
+        for r, room in zip(rooms, elements):
+            room.id = f"room-{r.id}"
+            room.class_ = ["room"] + r.tags # type: ignore[attr-defined]
+            room.data = {
+                "room-note": quote(r.note),
+                "room-encounter": quote("{\"items\":[]}"),
+                "x": r.location.x,
+                "y": r.location.y,
+            }
+        return elements
+
     @classmethod
     def draw_rooms(
         cls, rooms: Collection[Room], scale: int, fill: str, border: str, rng: Random, set_ids: bool = False
     ) -> List[svg.Element]:
-        ret = []
-        for r in rooms:
-            room = cls.draw_room(r, scale, fill, border, rng)
-            if set_ids:
-                room.id = f"room-{r.id}"
-                room.class_ = ["room"] + r.tags # type: ignore[attr-defined]
-                room.data = {
-                    "room-note": quote(r.note),
-                    "room-encounter": quote("{\"items\":[]}"),
-                    "x": r.location.x,
-                    "y": r.location.y,
-                }
-            ret.append(room)
+        ret = [cls.draw_room(r, scale, fill, border, rng) for r in rooms]
+        if set_ids:
+            cls.tag_rooms(rooms, ret)
         return ret
 
     @classmethod
@@ -263,27 +313,92 @@ def create_pattern(fp: Path, scale: int, grid: bool = False) -> List[svg.Element
         ))
     return img
 
-def paths_to_patterns(
-    background: Path,
-    room: Path,
-    hallway: Path,
-    room_wall: Path,
-    hall_wall: Path,
-    water: Path,
-    scale: int,
-    background_grid: bool,
-    room_grid: bool,
-    hall_grid: bool,
-) -> FillPatterns:
-    """Creates fill patterns from file paths."""
-    return FillPatterns(
-        create_pattern(background, scale, grid=background_grid),
-        create_pattern(room, scale, grid=room_grid),
-        create_pattern(hallway, scale, grid=hall_grid),
-        create_pattern(room_wall, scale),
-        create_pattern(hall_wall, scale),
-        create_pattern(water, scale, grid=room_grid),
-    )
+@dataclass(frozen=True)
+class TexturePaths:
+    """The texture files and grid settings of a floor type."""
+    background: Path
+    room: Path
+    hallway: Path
+    room_wall: Path
+    hall_wall: Path
+    water: Path
+    background_grid: bool = False
+    room_grid: bool = True
+    hall_grid: bool = True
+
+    def files(self) -> List[Path]:
+        return [self.background, self.room, self.hallway, self.room_wall, self.hall_wall, self.water]
+
+class TextureRegistry:
+    """Encodes each texture file at most once per scale and grid setting.
+
+    Patterns are encoded on first use and the same element lists are handed
+    to every floor type that uses them, so shared textures are only read and
+    kept in memory once."""
+
+    def __init__(self):
+        self._patterns: Dict[Tuple[Path, int, bool], List[svg.Element]] = {}
+        self._digests: Dict[Path, str] = {}
+
+    def pattern(self, fp: Path, scale: int, grid: bool = False) -> List[svg.Element]:
+        """Returns the pattern elements for a texture file."""
+        key = (fp.resolve(), scale, grid)
+        if key not in self._patterns:
+            with profiling.stage("encode_texture", texture = key[0].name):
+                self._patterns[key] = create_pattern(key[0], scale, grid)
+        return self._patterns[key]
+
+    def digest(self, fp: Path) -> str:
+        """Returns the sha256 hash of a texture file's contents."""
+        path = fp.resolve()
+        if path not in self._digests:
+            self._digests[path] = hashlib.sha256(path.read_bytes()).hexdigest()
+        return self._digests[path]
+
+    def fill_patterns(self, paths: TexturePaths, scale: int) -> FillPatterns:
+        """Returns the fill patterns of a floor type."""
+        return FillPatterns(
+            self.pattern(paths.background, scale, grid = paths.background_grid),
+            self.pattern(paths.room, scale, grid = paths.room_grid),
+            self.pattern(paths.hallway, scale, grid = paths.hall_grid),
+            self.pattern(paths.room_wall, scale),
+            self.pattern(paths.hall_wall, scale),
+            self.pattern(paths.water, scale, grid = paths.room_grid),
+        )
+
+# Registry for textures that are not part of a DunSpec
+shared_textures = TextureRegistry()
+
+def _set_texture(els: Optional[List[svg.Element]], cls: str, texture: str, set_fill: bool = True):
+    if els is not None:
+        for el in els:
+            if el.class_ is not None and cls in el.class_: # type: ignore[attr-defined]
+                el.stroke = texture # type: ignore[attr-defined]
+                if set_fill:
+                    el.fill = texture # type: ignore[attr-defined]
+            _set_texture(el.elements, cls, texture, set_fill)
+
+def _lower_floor_layer(
+    lower: svg.SVG,
+    floor_id: int,
+    room_top: bool,
+    hall_top: bool,
+) -> Tuple[Optional[svg.Element], Optional[svg.Element]]:
+    """Returns a copy of the foreground of a lower floor to draw beneath
+    another, and a copy of the shapes group it references."""
+    fg = find_element(lower, "fg-elements")
+    fg_els = strip_ids(fg.elements) if fg is not None else None
+    if fg_els is None:
+        return (None, None)
+    if room_top:
+        _set_texture(fg_els, "room", "url(#room_top_pattern)")
+        if hall_top:
+            _set_texture(fg_els, "hall", "url(#room_top_pattern)", set_fill = False)
+    shapes = find_element(lower, "shapes")
+    if shapes is not None:
+        shapes = copy(shapes)
+        shapes.id = f"shapes_{floor_id}"
+    return (svg.G(elements = fg_els, id = f"bg_floor_{floor_id}"), shapes)
 
 def handle_no_floors(
     imgs: List[svg.SVG],
@@ -292,17 +407,13 @@ def handle_no_floors(
     max_trans_floors: int = 3,
     ground_floor_halls: bool = False,
     room_top_texture: Optional[str] = None,
+    by_reference: bool = False,
 ):
-    """Make floors transparent, showing levels below."""
-    def set_texture(els, cls: str, texture: str, set_fill: bool = True):
-        if els is not None:
-            for el in els:
-                if el.class_ is not None and cls in el.class_:
-                    el.stroke = texture
-                    if set_fill:
-                        el.fill = texture
-                set_texture(el.elements, cls, texture, set_fill)
+    """Make floors transparent, showing levels below.
 
+    With by_reference set, the floors below are not copied in. Each floor
+    holds a placeholder naming the floor to show instead, which
+    compose_floor fills in when the floor is displayed or exported."""
     if not ground_floor_halls:
         # Remove hallways and their walls and replace them with background
         # texture for the lowest floor
@@ -310,11 +421,11 @@ def handle_no_floors(
         remove_children(imgs[-1], "hall_walls")
         fg = find_element(imgs[-1], "fg-elements")
         if fg is not None:
-            set_texture(fg.elements, "hall", "url(#background_pattern)", set_fill = False)
+            _set_texture(fg.elements, "hall", "url(#background_pattern)", set_fill = False)
 
     if room_top_texture is not None:
         # Add a texture to all but the lowest floor with a roof pattern
-        room_top = create_pattern(Path(room_top_texture).absolute(), scale)
+        room_top = shared_textures.pattern(Path(room_top_texture).absolute(), scale)
         for img in imgs[:-1]:
             append_children(img, "defs", [
                 svg.Pattern(
@@ -331,29 +442,70 @@ def handle_no_floors(
         floor_num = min(len(imgs) - 1, i + max_trans_floors)
         curr_opacity: float = (floor_num - i) * opacity_inc
         while floor_num > i:
-            fg = find_element(imgs[floor_num], "fg-elements")
-            if fg is None:
-                continue
-            fg_els = strip_ids(fg.elements)
-            if fg_els is None:
-                continue
-
-            if room_top_texture is not None:
-                set_texture(fg_els, "room", "url(#room_top_pattern)")
-                if floor_num < len(imgs) - 1 or ground_floor_halls:
-                    set_texture(fg_els, "hall", "url(#room_top_pattern)", set_fill = False)
-
-            new_els: List[svg.Element] = [
-                svg.G(
-                    elements = fg_els,
-                    id = f"bg_floor_{floor_num + 1}",
-                ),
-                svg.Rect(
-                    x = 0, y = 0,
-                    width = img.width, height = img.height,
-                    fill = "black", opacity = curr_opacity,
-                ),
-            ]
-            append_children(img, "bg-elements", new_els, before = "hall_walls")
+            hall_top = floor_num < len(imgs) - 1 or ground_floor_halls
+            layer: Optional[svg.Element]
+            if by_reference:
+                layer = svg.G(id = f"bg_floor_{floor_num + 1}", data = {
+                    "floor-ref": str(floor_num + 1),
+                    "room-top": str(room_top_texture is not None).lower(),
+                    "hall-top": str(hall_top).lower(),
+                })
+            else:
+                # The copied layers reference the shapes of the lower floor
+                layer, shapes = _lower_floor_layer(
+                    imgs[floor_num], floor_num + 1, room_top_texture is not None, hall_top,
+                )
+                if shapes is not None:
+                    append_children(img, "defs", [shapes])
+
+            if layer is not None:
+                append_children(img, "bg-elements", [
+                    layer,
+                    svg.Rect(
+                        x = 0, y = 0,
+                        width = img.width, height = img.height,
+                        fill = "black", opacity = curr_opacity,
+                    ),
+                ], before = "hall_walls")
             floor_num -= 1
             curr_opacity -= opacity_inc
+
+def compose_floor(img: svg.SVG, floor: Callable[[int], Optional[svg.SVG]]) -> svg.SVG:
+    """Returns img with the lower floors referenced by handle_no_floors
+    drawn in, fetching floors of the level by number with floor. img is
+    left unchanged, and returned as is if it references no floors."""
+    bg = find_element(img, "bg-elements")
+    refs = [
+        el for el in bg.elements if el.data is not None and "floor-ref" in el.data
+    ] if bg is not None and bg.elements is not None else []
+    if not refs:
+        return img
+
+    layers: Dict[int, svg.Element] = {}
+    shapes: List[svg.Element] = []
+    for ref in refs:
+        data = cast(Dict[str, str], ref.data)
+        floor_id = int(data["floor-ref"])
+        lower = floor(floor_id)
+        if lower is None:
+            continue
+        layer, lower_shapes = _lower_floor_layer(
+            lower, floor_id, data.get("room-top") == "true", data.get("hall-top") == "true",
+        )
+        if layer is not None:
+            layers[id(ref)] = layer
+        if lower_shapes is not None:
+            shapes.append(lower_shapes)
+
+    def fill_refs(el: svg.Element) -> svg.Element:
+        el_copy = copy(el)
+        el_copy.elements = [layers.get(id(child), child) for child in el.elements or []]
+        return el_copy
+
+    def add_shapes(el: svg.Element) -> svg.Element:
+        el_copy = copy(el)
+        el_copy.elements = (el.elements or []) + shapes
+        return el_copy
+
+    img = replace_element(img, "bg-elements", fill_refs)
+    return replace_element(img, "defs", add_shapes)
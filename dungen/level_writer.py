@@ -0,0 +1,124 @@
+import svg
+import threading
+
+from dataclasses import dataclass
+from pathlib import Path
+from queue import Queue
+from typing import Dict, List, Optional
+
+from .drawing import write_svg
+from .dungensave import DungenSave
+from .level_drawer import compose_floor
+from .level_cache import LevelCache
+from .rooms import Point
+
+
+@dataclass
+class FinishedLevel:
+    """A drawn level waiting to be written out."""
+    lvlid: int
+    floors: Dict[int, svg.SVG]
+    note: str
+    svg_text: Optional[List[str]] = None
+    # Set for newly generated levels that should be added to the cache
+    cache_key: Optional[str] = None
+    stairs_down: Optional[List[Point]] = None
+
+
+def write_svgs(
+    svg_out: Path,
+    lvlid: int,
+    imgs: List[svg.SVG],
+    svg_text: Optional[List[str]] = None,
+):
+    """Exports the floors of a level to svg_out/level_<lvlid>/floor_<n>.svg,
+    using svg_text when the floors have already been serialized and
+    streaming them to the files otherwise. Floors that show the floors
+    below them by reference are exported with those floors drawn in."""
+    svg_out.mkdir(exist_ok = True)
+    level_dir = svg_out.joinpath(f"level_{lvlid}")
+    level_dir.mkdir(exist_ok = True)
+    for j, img in enumerate(imgs):
+        svg_path = level_dir.joinpath(f"floor_{j + 1}.svg")
+        if svg_text:
+            svg_path.write_text(svg_text[j])
+        else:
+            with svg_path.open("w") as f:
+                write_svg(compose_floor(img, lambda n: imgs[n - 1]), f)
+
+
+class LevelWriter:
+    """Writes finished levels to a savefile (and optionally SVG files) on a
+    background thread.
+
+    Levels are handed over through a bounded queue, so generation only
+    waits when the writer falls `depth` levels behind. Levels are inserted
+    into the savefile `batch` at a time, each batch in one transaction.
+    Newly generated levels are also stored in the cache, if one is given."""
+
+    def __init__(
+        self,
+        savefile: DungenSave,
+        svg_out: Optional[Path] = None,
+        batch: int = 4,
+        depth: int = 8,
+        cache: Optional[LevelCache] = None,
+    ):
+        self.savefile = savefile
+        self.svg_out = svg_out
+        self.cache = cache
+        self.batch = max(1, batch)
+        self._queue: Queue[Optional[FinishedLevel]] = Queue(maxsize = max(1, depth))
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target = self._run, name = "LevelWriter", daemon = True)
+        self._thread.start()
+
+    def __enter__(self) -> "LevelWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def put(self, level: FinishedLevel):
+        """Queues a level for writing, blocking while the queue is full."""
+        self._raise_error()
+        self._queue.put(level)
+
+    def close(self):
+        """Writes any queued levels and stops the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _flush(self, pending: List[FinishedLevel]):
+        if not pending:
+            return
+        try:
+            self.savefile.add_levels([(l.lvlid, l.floors, l.note) for l in pending])
+            if self.svg_out is not None:
+                for l in pending:
+                    write_svgs(self.svg_out, l.lvlid, list(l.floors.values()), l.svg_text)
+            if self.cache is not None:
+                for l in pending:
+                    if l.cache_key is not None and l.stairs_down is not None:
+                        self.cache.put(l.cache_key, l.stairs_down, list(l.floors.values()))
+        except BaseException as e:
+            self._error = e
+        finally:
+            pending.clear()
+
+    def _run(self):
+        pending: List[FinishedLevel] = []
+        while (level := self._queue.get()) is not None:
+            # After an error keep draining, so producers never block
+            if self._error is None:
+                pending.append(level)
+                if len(pending) >= self.batch:
+                    self._flush(pending)
+        if self._error is None:
+            self._flush(pending)
@@ -3,12 +3,14 @@ import svg
 
 from enum import Enum
 from random import Random
+from typing import Tuple
 
 from .connections import Hallway
+from .geometry import ShapeBatch
 from .level import Level
 from .level_drawer import LevelDrawer
 from .rooms import Room, Point, Stairs
-from .rect_room_drawer import Sides, random_point
+from .rect_room_drawer import Sides, hallway_pathstr, hallway_points, hallway_route
 
 def is_room_near_square(room: Room) -> bool:
     """Returns true if the room is within 10% of square."""
@@ -17,6 +19,22 @@ def is_room_near_square(room: Room) -> bool:
         and room.width / room.height <= 1.1
     )
 
+def mixed_hallway_route(hallway: Hallway, rng: Random) -> Tuple[Point, Sides, Point, Point, Sides]:
+    """Routes a hallway like the rect drawer, but from and to the center of
+    round rooms."""
+    start, room1_side, _, end, room2_side = hallway_route(hallway, rng)
+    if is_room_near_square(hallway.room1):
+        radius = int(((hallway.room1.width + hallway.room1.height) / 2) / 2)
+        start = Point(hallway.room1.location.x + radius, hallway.room1.location.y + radius)
+    if is_room_near_square(hallway.room2):
+        radius = int(((hallway.room2.width + hallway.room2.height) / 2) / 2)
+        end = Point(hallway.room2.location.x + radius, hallway.room2.location.y + radius)
+    middle = Point(
+        int((start.x + end.x) / 2),
+        int((start.y + end.y) / 2),
+    )
+    return (start, room1_side, middle, end, room2_side)
+
 class MixedRoomDrawer(LevelDrawer):
     """Draws rectangular and circular rooms and straight hallways."""
     @staticmethod
@@ -45,71 +63,39 @@ class MixedRoomDrawer(LevelDrawer):
             paint_order = "stroke",
         )
 
+    @classmethod
+    def shape_room(
+        cls, shapes: ShapeBatch, room: Room, scale: int, rng: Random
+    ) -> int:
+        if is_room_near_square(room):
+            radius = int(((room.width + room.height) / 2) / 2)
+            return shapes.add_circle(
+                (room.location.x + radius) * scale,
+                (room.location.y + radius) * scale,
+                radius * scale,
+                paint_order = "stroke",
+            )
+        return shapes.add_rect(
+            room.location.x * scale,
+            room.location.y * scale,
+            room.width * scale,
+            room.height * scale,
+            paint_order = "stroke",
+        )
+
     @staticmethod
     def draw_hallway(
         hallway: Hallway, scale: int, fill: str, width: int, rng: Random
     ) -> svg.Element:
-       # pick sides
-       room1_side = None
-       room2_side = None
-       if (
-           hallway.room1.location.x < hallway.room2.location.x
-           and hallway.room1.location.y < hallway.room2.location.y
-       ):
-           #hallway.room1 upper left of hallway.room2
-           room1_side = rng.choice([Sides.RIGHT, Sides.BOTTOM])
-           room2_side = rng.choice([Sides.LEFT, Sides.TOP])
-       elif (
-           hallway.room1.location.x > hallway.room2.location.x
-           and hallway.room1.location.y < hallway.room2.location.y
-       ):
-           #hallway.room1 upper right of hallway.room2
-           room1_side = rng.choice([Sides.LEFT, Sides.BOTTOM])
-           room2_side = rng.choice([Sides.RIGHT, Sides.TOP])
-       elif (
-           hallway.room1.location.x < hallway.room2.location.x
-           and hallway.room1.location.y > hallway.room2.location.y
-       ):
-           #hallway.room1 lower left of hallway.room2
-           room1_side = rng.choice([Sides.RIGHT, Sides.TOP])
-           room2_side = rng.choice([Sides.LEFT, Sides.BOTTOM])
-       else:
-           #hallway.room1 lower right of hallway.room2
-           room1_side = rng.choice([Sides.LEFT, Sides.TOP])
-           room2_side = rng.choice([Sides.RIGHT, Sides.BOTTOM])
-
-       # generate points
-       start = random_point(hallway.room1, room1_side, rng)
-       if is_room_near_square(hallway.room1):
-           radius = int(((hallway.room1.width + hallway.room1.height) / 2) / 2)
-           start = Point(hallway.room1.location.x + radius, hallway.room1.location.y + radius)
-       end = random_point(hallway.room2, room2_side, rng)
-       if is_room_near_square(hallway.room2):
-           radius = int(((hallway.room2.width + hallway.room2.height) / 2) / 2)
-           end = Point(hallway.room2.location.x + radius, hallway.room2.location.y + radius)
-       middle = Point(
-           int((start.x + end.x) / 2),
-           int((start.y + end.y) / 2),
-       )
-
-       # create pathspec
-       path = f"M {start.x * scale} {start.y * scale} "
-       if room1_side in [Sides.LEFT, Sides.RIGHT]:
-           # make horizontal line first
-           path += f"H {middle.x * scale} V {middle.y * scale} "
-       else:
-           # make a vertical line first
-           path += f"V {middle.y * scale} H {middle.x * scale} "
-       if room2_side in [Sides.LEFT, Sides.RIGHT]:
-           # make horizontal line last
-           path += f"V {end.y * scale} H {end.x * scale}"
-       else:
-           # make a vertical line last
-           path += f"H {end.x * scale} V {end.y * scale}"
-
        return svg.Path(
-           d = path,  # type: ignore[arg-type]
+           d = hallway_pathstr(*mixed_hallway_route(hallway, rng), scale),  # type: ignore[arg-type]
            fill = "transparent",
            stroke = fill,
            stroke_width = scale * width,
        )
+
+    @classmethod
+    def shape_hallway(
+        cls, shapes: ShapeBatch, hallway: Hallway, scale: int, width: int, rng: Random
+    ) -> int:
+        return shapes.add_polyline(hallway_points(*mixed_hallway_route(hallway, rng), scale))
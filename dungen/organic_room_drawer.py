@@ -1,41 +1,60 @@
 import math
+import numpy as np
 import svg
 
 from enum import Enum
 from random import Random
-from typing import List
+from typing import Iterator, List, Tuple
 
 from .connections import Hallway
+from .geometry import PATH_PRECISION, ShapeBatch, encode_path
 from .level import Level
 from .level_drawer import LevelDrawer
 from .rooms import Room, Point, Stairs
 
 PATH_SEG_LEN = 1.5
+# Share of each walk step taken in a random direction rather than
+# towards the goal
+RAND_STEP = 0.4
 
-def l2_dist(p1: Point, p2: Point) -> float:
-    return math.sqrt(
-        math.pow((p2.x - p1.x), 2) +
-        math.pow((p2.y - p1.y), 2)
-    )
+class StepNoise:
+    """An endless stream of random unit vectors for walk steps, generated
+    in NumPy batches from a seed drawn from rng."""
 
-def random_walk(start: Point, end: Point, vlen: float, rng: Random) -> List[Point]:
-    """Draws a randomly walked path between start and end."""
-    curr = start
-    path: List[Point] = []
-    rand_vec = 0.4
-    while l2_dist(curr, end) > vlen:
-        goal_vec_angle = math.atan2(end.y - curr.y, end.x - curr.x)
-        rand_vec_angle = rng.uniform(0, 2*math.pi)
-
-        next_point = Point(
-            curr.x + (rand_vec * vlen * math.cos(rand_vec_angle)) + ((1 - rand_vec) * vlen * math.cos(goal_vec_angle)),
-            curr.y + (rand_vec * vlen * math.sin(rand_vec_angle)) + ((1 - rand_vec) * vlen * math.sin(goal_vec_angle)),
-        )
-        path.append(curr)
-        curr = next_point
-    if len(path) == 0:
-        return [start]
-    return path
+    def __init__(self, rng: Random, batch: int = 64):
+        self.gen = np.random.default_rng(rng.getrandbits(64))
+        self.batch = batch
+        self.vectors = self._vectors()
+
+    def _vectors(self) -> Iterator[Tuple[float, float]]:
+        while True:
+            angles = self.gen.uniform(0, 2 * math.pi, self.batch)
+            yield from zip(np.cos(angles).tolist(), np.sin(angles).tolist())
+
+def _walk(start: Point, end: Point, vlen: float, noise: StepNoise, out: List[float]):
+    # Appends the x, y of each point visited to out
+    x, y = start.x, start.y
+    ex, ey = end.x, end.y
+    rand_len = RAND_STEP * vlen
+    goal_len = (1 - RAND_STEP) * vlen
+    count = len(out)
+    for rx, ry in noise.vectors:
+        dx, dy = ex - x, ey - y
+        dist = math.hypot(dx, dy)
+        if dist <= vlen:
+            break
+        out += (x, y)
+        x += rand_len * rx + goal_len * dx / dist
+        y += rand_len * ry + goal_len * dy / dist
+    if len(out) == count:
+        out += (start.x, start.y)
+
+def random_walk(start: Point, end: Point, vlen: float, noise: StepNoise) -> np.ndarray:
+    """Draws a randomly walked path between start and end, returning the
+    points visited before coming within vlen of end as an (n, 2) array."""
+    out: List[float] = []
+    _walk(start, end, vlen, noise, out)
+    return np.array(out).reshape(-1, 2)
 
 def random_point_in_triangle(p1: Point, p2: Point, p3: Point, rng: Random) -> Point:
     """Chooses a random point in a triangular region."""
@@ -46,62 +65,59 @@ def random_point_in_triangle(p1: Point, p2: Point, p3: Point, rng: Random) -> Po
         (p1.y * s) + (t * p2.y) + (u * p3.y),
     )
 
-def random_point_on_ellipse(
-    center: Point,
-    width: int,
-    height: int, 
-    min_angle: float,
-    max_angle: float,
-    rng: Random,
-) -> Point:
-    """Chooses a random point along the edge of an elipse."""
-    angle = rng.uniform(min_angle, max_angle)
-    return Point(
-        center.x + ((width / 2) * math.cos(angle)),
-        center.y + ((height / 2) * math.sin(angle)),
-    )
+def points_to_pathstr(
+    points: np.ndarray, scale: int, closed: bool = True, precision: int = PATH_PRECISION
+) -> str:
+    return encode_path(points * scale, closed, precision)
+
+def room_outline(room: Room, rng: Random) -> np.ndarray:
+    """Walks a meandering outline around the ellipse inside a room."""
+    noise = StepNoise(rng)
+    num_int_points = 16
+    sector = (2 * math.pi) / num_int_points
+    angles = (np.arange(num_int_points) + noise.gen.random(num_int_points)) * sector
+    xs = room.location.x + (room.width / 2) * (1 + np.cos(angles))
+    ys = room.location.y + (room.height / 2) * (1 + np.sin(angles))
+    corners = [Point(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+    out: List[float] = []
+    for i in range(num_int_points):
+        _walk(corners[i], corners[(i + 1) % num_int_points], PATH_SEG_LEN, noise, out)
+    return np.array(out).reshape(-1, 2)
 
-def points_to_pathstr(points: List[Point], scale: int, closed: bool = True) -> str:
-    pathstr = f"M {points[0].x * scale} {points[0].y * scale} "
-    for i in range(1, len(points)):
-        pathstr += f"L {points[i].x * scale} {points[i].y * scale} "
-    if closed:
-        pathstr += "Z"
-    return pathstr
+def hallway_walk(hallway: Hallway, rng: Random) -> np.ndarray:
+    """Walks a meandering path between the centers of two rooms."""
+    start_point = Point(
+        int(hallway.room1.location.x + (hallway.room1.width  / 2)),
+        int(hallway.room1.location.y + (hallway.room1.height / 2)),
+    )
+    mid_point = random_point_in_triangle(
+        hallway.room1.location,
+        Point(hallway.room1.location.x, hallway.room2.location.y) if rng.random() < 0.5
+        else Point(hallway.room2.location.x, hallway.room1.location.y),
+        hallway.room2.location,
+        rng,
+    )
+    end_point = Point(
+        int(hallway.room2.location.x + (hallway.room2.width  / 2)),
+        int(hallway.room2.location.y + (hallway.room2.height / 2)),
+    )
+    noise = StepNoise(rng)
+    out: List[float] = []
+    _walk(start_point, mid_point, PATH_SEG_LEN, noise, out)
+    _walk(mid_point, end_point, PATH_SEG_LEN, noise, out)
+    return np.array(out).reshape(-1, 2)
 
 class OrganicRoomDrawer(LevelDrawer):
     """Draws organic looking rooms and meandering hallways."""
 
+    room_wall_width = 2
+
     @staticmethod
     def draw_room(
         room: Room, scale: int, fill: str, border: str, rng: Random
     ) -> svg.Element:
-        center_point = Point(
-            room.location.x + (room.width / 2),
-            room.location.y + (room.height / 2),
-        )
-        num_int_points = 16
-        points: List[Point] = []
-        first_point = None
-        last_point = None
-        for i in range(num_int_points):
-            p = random_point_on_ellipse(
-                center_point,
-                room.width,
-                room.height, 
-                ((2 * math.pi) / num_int_points) * i,
-                ((2 * math.pi) / num_int_points) * (i + 1),
-                rng,
-            )
-            if last_point is not None:
-                points += random_walk(last_point, p, PATH_SEG_LEN, rng)
-            else:
-                first_point = p
-            last_point = p
-        points += random_walk(last_point, first_point, PATH_SEG_LEN, rng) # type: ignore[arg-type]
-
         return svg.Path(
-            d = points_to_pathstr(points, scale), # type: ignore[arg-type]
+            d = points_to_pathstr(room_outline(room, rng), scale), # type: ignore[arg-type]
             fill = fill,
             stroke = border,
             stroke_width = scale * 2,
@@ -109,31 +125,36 @@ class OrganicRoomDrawer(LevelDrawer):
             stroke_linejoin = "bevel",
         )
 
+    @classmethod
+    def shape_room(
+        cls, shapes: ShapeBatch, room: Room, scale: int, rng: Random
+    ) -> int:
+        return shapes.add_polyline(
+            room_outline(room, rng) * scale,
+            closed = True,
+            simplify = True,
+            paint_order = "stroke",
+            stroke_linejoin = "bevel",
+        )
+
     @staticmethod
     def draw_hallway(
         hallway: Hallway, scale: int, fill: str, width: int, rng: Random
     ) -> svg.Element:
-       start_point = Point(
-           int(hallway.room1.location.x + (hallway.room1.width  / 2)),
-           int(hallway.room1.location.y + (hallway.room1.height / 2)),
-       )
-       mid_point = random_point_in_triangle(
-           hallway.room1.location,
-           Point(hallway.room1.location.x, hallway.room2.location.y) if rng.random() < 0.5
-           else Point(hallway.room2.location.x, hallway.room1.location.y),
-           hallway.room2.location,
-           rng,
-       )
-       end_point = Point(
-           int(hallway.room2.location.x + (hallway.room2.width  / 2)),
-           int(hallway.room2.location.y + (hallway.room2.height / 2)),
-       )
-       points = random_walk(start_point, mid_point, PATH_SEG_LEN, rng)
-       points += random_walk(mid_point, end_point, PATH_SEG_LEN, rng)
        return svg.Path(
-           d = points_to_pathstr(points, scale, closed=False), # type: ignore[arg-type]
+           d = points_to_pathstr(hallway_walk(hallway, rng), scale, closed=False), # type: ignore[arg-type]
            fill = "transparent",
            stroke = fill,
            stroke_width = scale * width,
            stroke_linejoin = "bevel",
        )
+
+    @classmethod
+    def shape_hallway(
+        cls, shapes: ShapeBatch, hallway: Hallway, scale: int, width: int, rng: Random
+    ) -> int:
+        return shapes.add_polyline(
+            hallway_walk(hallway, rng) * scale,
+            simplify = True,
+            stroke_linejoin = "bevel",
+        )
@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class StageRecord:
+    """Timing of one run of a generation stage."""
+    name: str
+    start_us: int
+    wall: float
+    cpu: float
+    peak_mem: int
+    tags: Dict[str, Any] = field(default_factory=dict)
+    pid: int = 0
+    tid: int = 0
+
+
+@dataclass
+class _Frame:
+    tags: Dict[str, Any]
+    peak: int
+
+
+class _Tracer:
+    def __init__(self, memory: bool):
+        self.memory = memory
+        self.pid = os.getpid()
+        self.records: List[StageRecord] = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def frames(self) -> List[_Frame]:
+        if not hasattr(self.local, "frames"):
+            self.local.frames = []
+        return self.local.frames
+
+
+_tracer: Optional[_Tracer] = None
+
+def enable(memory: bool = True):
+    """Starts recording stages in this process. Peak memory is tracked with
+    tracemalloc when memory is set, which slows generation down."""
+    global _tracer
+    _tracer = _Tracer(memory)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def enabled() -> bool:
+    return _tracer is not None
+
+def enable_in_worker():
+    """Starts recording stages in a pool worker. A forked worker inherits
+    the tracer of its parent along with its pending records, so it starts
+    afresh with the same memory setting."""
+    if _tracer is None or _tracer.pid != os.getpid():
+        enable(_tracer.memory if _tracer is not None else True)
+
+def drain() -> List[StageRecord]:
+    """Returns and forgets the stages recorded so far."""
+    if _tracer is None:
+        return []
+    with _tracer.lock:
+        records, _tracer.records = _tracer.records, []
+    return records
+
+def add_records(records: List[StageRecord]):
+    """Adds stages recorded elsewhere, such as in a worker process."""
+    if _tracer is not None:
+        with _tracer.lock:
+            _tracer.records.extend(records)
+
+def run_recorded(record: bool, fn: Callable[..., T], *args, **kwargs) -> Tuple[T, List[StageRecord]]:
+    """Calls fn, returning its result with the stages it recorded. Meant for
+    pool workers, whose records are passed back to add_records."""
+    if record:
+        enable_in_worker()
+    result = fn(*args, **kwargs)
+    return (result, drain())
+
+@contextmanager
+def stage(name: str, **tags) -> Iterator[None]:
+    """Records the wall time, CPU time and peak traced memory of the block.
+    Tags of enclosing stages are inherited, so a stage run inside
+    `stage("floor", level=1, floor=2)` is tagged with that level and floor.
+    tracemalloc peaks cover the whole process, so memory is only tracked
+    on the main thread, and stages on other threads record a peak of 0.
+    Does nothing unless profiling is enabled."""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    frames = tracer.frames()
+    parent = frames[-1] if frames else None
+    memory = tracer.memory and threading.current_thread() is threading.main_thread()
+    if memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if parent is not None:
+            parent.peak = max(parent.peak, peak)
+        tracemalloc.reset_peak()
+    else:
+        current = 0
+    frame = _Frame((parent.tags if parent else {}) | tags, current)
+    frames.append(frame)
+    start_us = time.time_ns() // 1000
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        cpu = time.thread_time() - cpu
+        wall = time.perf_counter() - wall
+        frames.pop()
+        if memory:
+            frame.peak = max(frame.peak, tracemalloc.get_traced_memory()[1])
+            if parent is not None:
+                parent.peak = max(parent.peak, frame.peak)
+        with tracer.lock:
+            tracer.records.append(StageRecord(
+                name, start_us, wall, cpu, frame.peak, frame.tags,
+                os.getpid(), threading.get_native_id(),
+            ))
+
+def write_trace(records: List[StageRecord], path: Path):
+    """Writes records in the Chrome trace event format."""
+    events = [
+        {
+            "name": r.name,
+            "cat": "dungen",
+            "ph": "X",
+            "ts": r.start_us,
+            "dur": int(r.wall * 1e6),
+            "pid": r.pid,
+            "tid": r.tid,
+            "args": r.tags | {
+                "cpu_ms": round(r.cpu * 1000, 3),
+                "peak_mem_kb": r.peak_mem // 1024,
+            },
+        } for r in records
+    ]
+    with path.open("w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+def print_summary(records: List[StageRecord], out: TextIO):
+    """Prints total wall and CPU time and the largest peak memory of each
+    stage."""
+    stages: Dict[str, List[StageRecord]] = {}
+    for r in records:
+        stages.setdefault(r.name, []).append(r)
+    print(f"{'stage':20} {'count':>6} {'wall s':>10} {'cpu s':>10} {'peak MB':>9}", file = out)
+    for name, recs in sorted(stages.items(), key = lambda s: -sum(r.wall for r in s[1])):
+        print(
+            f"{name:20} {len(recs):6} {sum(r.wall for r in recs):10.3f} "
+            + f"{sum(r.cpu for r in recs):10.3f} {max(r.peak_mem for r in recs) / 2**20:9.1f}",
+            file = out,
+        )
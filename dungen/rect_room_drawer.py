@@ -1,10 +1,13 @@
 import math
+import numpy as np
 import svg
 
 from enum import Enum
 from random import Random
+from typing import Tuple
 
 from .connections import Hallway
+from .geometry import ShapeBatch
 from .level import Level
 from .level_drawer import LevelDrawer
 from .rooms import Room, Point, Stairs
@@ -32,6 +35,82 @@ def random_point(room: Room, wall: Sides, rng: Random) -> Point:
             y += room.height - 2
     return Point(x, y)
 
+def hallway_route(hallway: Hallway, rng: Random) -> Tuple[Point, Sides, Point, Point, Sides]:
+    """Picks the sides a hallway leaves and enters its rooms from, and the
+    points it starts at, turns around and ends at."""
+    # pick sides
+    room1_side = None
+    room2_side = None
+    if (
+        hallway.room1.location.x < hallway.room2.location.x
+        and hallway.room1.location.y < hallway.room2.location.y
+    ):
+        #hallway.room1 upper left of hallway.room2
+        room1_side = rng.choice([Sides.RIGHT, Sides.BOTTOM])
+        room2_side = rng.choice([Sides.LEFT, Sides.TOP])
+    elif (
+        hallway.room1.location.x > hallway.room2.location.x
+        and hallway.room1.location.y < hallway.room2.location.y
+    ):
+        #hallway.room1 upper right of hallway.room2
+        room1_side = rng.choice([Sides.LEFT, Sides.BOTTOM])
+        room2_side = rng.choice([Sides.RIGHT, Sides.TOP])
+    elif (
+        hallway.room1.location.x < hallway.room2.location.x
+        and hallway.room1.location.y > hallway.room2.location.y
+    ):
+        #hallway.room1 lower left of hallway.room2
+        room1_side = rng.choice([Sides.RIGHT, Sides.TOP])
+        room2_side = rng.choice([Sides.LEFT, Sides.BOTTOM])
+    else:
+        #hallway.room1 lower right of hallway.room2
+        room1_side = rng.choice([Sides.LEFT, Sides.TOP])
+        room2_side = rng.choice([Sides.RIGHT, Sides.BOTTOM])
+
+    # generate points
+    start = random_point(hallway.room1, room1_side, rng)
+    end = random_point(hallway.room2, room2_side, rng)
+    middle = Point(
+        int((start.x + end.x) / 2),
+        int((start.y + end.y) / 2),
+    )
+    return (start, room1_side, middle, end, room2_side)
+
+def hallway_pathstr(
+    start: Point, room1_side: Sides, middle: Point, end: Point, room2_side: Sides, scale: int
+) -> str:
+    """Returns the path of a hallway made of horizontal and vertical lines."""
+    path = f"M {start.x * scale} {start.y * scale} "
+    if room1_side in [Sides.LEFT, Sides.RIGHT]:
+        # make horizontal line first
+        path += f"H {middle.x * scale} V {middle.y * scale} "
+    else:
+        # make a vertical line first
+        path += f"V {middle.y * scale} H {middle.x * scale} "
+    if room2_side in [Sides.LEFT, Sides.RIGHT]:
+        # make horizontal line last
+        path += f"V {end.y * scale} H {end.x * scale}"
+    else:
+        # make a vertical line last
+        path += f"H {end.x * scale} V {end.y * scale}"
+    return path
+
+def hallway_points(
+    start: Point, room1_side: Sides, middle: Point, end: Point, room2_side: Sides, scale: int
+) -> np.ndarray:
+    """Returns the corners of the path drawn by hallway_pathstr."""
+    if room1_side in [Sides.LEFT, Sides.RIGHT]:
+        first = (middle.x, start.y)
+    else:
+        first = (start.x, middle.y)
+    if room2_side in [Sides.LEFT, Sides.RIGHT]:
+        last = (middle.x, end.y)
+    else:
+        last = (end.x, middle.y)
+    return np.array([
+        (start.x, start.y), first, (middle.x, middle.y), last, (end.x, end.y),
+    ]) * scale
+
 class RectRoomDrawer(LevelDrawer):
     """Draws rectangular rooms and straight hallways."""
 
@@ -50,66 +129,32 @@ class RectRoomDrawer(LevelDrawer):
             paint_order = "stroke",
         )
 
+    @classmethod
+    def shape_room(
+        cls, shapes: ShapeBatch, room: Room, scale: int, rng: Random
+    ) -> int:
+        return shapes.add_rect(
+            room.location.x * scale,
+            room.location.y * scale,
+            room.width * scale,
+            room.height * scale,
+            paint_order = "stroke",
+        )
+
     @staticmethod
     def draw_hallway(
         hallway: Hallway, scale: int, fill: str, width: int, rng: Random
     ) -> svg.Element:
-        # pick sides
-        room1_side = None
-        room2_side = None
-        if (
-            hallway.room1.location.x < hallway.room2.location.x
-            and hallway.room1.location.y < hallway.room2.location.y
-        ):
-            #hallway.room1 upper left of hallway.room2
-            room1_side = rng.choice([Sides.RIGHT, Sides.BOTTOM])
-            room2_side = rng.choice([Sides.LEFT, Sides.TOP])
-        elif (
-            hallway.room1.location.x > hallway.room2.location.x
-            and hallway.room1.location.y < hallway.room2.location.y
-        ):
-            #hallway.room1 upper right of hallway.room2
-            room1_side = rng.choice([Sides.LEFT, Sides.BOTTOM])
-            room2_side = rng.choice([Sides.RIGHT, Sides.TOP])
-        elif (
-            hallway.room1.location.x < hallway.room2.location.x
-            and hallway.room1.location.y > hallway.room2.location.y
-        ):
-            #hallway.room1 lower left of hallway.room2
-            room1_side = rng.choice([Sides.RIGHT, Sides.TOP])
-            room2_side = rng.choice([Sides.LEFT, Sides.BOTTOM])
-        else:
-            #hallway.room1 lower right of hallway.room2
-            room1_side = rng.choice([Sides.LEFT, Sides.TOP])
-            room2_side = rng.choice([Sides.RIGHT, Sides.BOTTOM])
-
-        # generate points
-        start = random_point(hallway.room1, room1_side, rng)
-        end = random_point(hallway.room2, room2_side, rng)
-        middle = Point(
-            int((start.x + end.x) / 2),
-            int((start.y + end.y) / 2),
-        )
-
-        # create pathspec
-        path = f"M {start.x * scale} {start.y * scale} "
-        if room1_side in [Sides.LEFT, Sides.RIGHT]:
-            # make horizontal line first
-            path += f"H {middle.x * scale} V {middle.y * scale} "
-        else:
-            # make a vertical line first
-            path += f"V {middle.y * scale} H {middle.x * scale} "
-        if room2_side in [Sides.LEFT, Sides.RIGHT]:
-            # make horizontal line last
-            path += f"V {end.y * scale} H {end.x * scale}"
-        else:
-            # make a vertical line last
-            path += f"H {end.x * scale} V {end.y * scale}"
-
         return svg.Path(
-            d = path,  # type: ignore[arg-type]
+            d = hallway_pathstr(*hallway_route(hallway, rng), scale),  # type: ignore[arg-type]
             fill = "transparent",
             stroke = fill,
             stroke_width = scale * width,
             class_ = ["hall"],
         )
+
+    @classmethod
+    def shape_hallway(
+        cls, shapes: ShapeBatch, hallway: Hallway, scale: int, width: int, rng: Random
+    ) -> int:
+        return shapes.add_polyline(hallway_points(*hallway_route(hallway, rng), scale))
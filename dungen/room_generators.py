@@ -1,11 +1,13 @@
-import random
+import numpy as np
 
+from collections import defaultdict
 from dataclasses import dataclass, field, fields
-from typing import Any, Dict, List, Optional, Union, Generator
-from uuid import uuid4
+from random import Random
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union, Generator
 
 from .connections import Bound
 from .rooms import Point, Room, Stairs
+from .room_table import MONSTERS, SHOP, TRAP, TREASURE, RoomTable
 
 
 @dataclass(frozen=True, eq=True)
@@ -37,106 +39,225 @@ class LevelSpec:
         return LevelSpec(**(curr | kwargs))
 
 
-def UniformRoomFactory(
+def _numpy_rng(rng: Random) -> np.random.Generator:
+    """Returns a NumPy generator seeded from rng."""
+    return np.random.default_rng(rng.getrandbits(128))
+
+def _random_ids(gen: np.random.Generator, count: int) -> np.ndarray:
+    """Draws count version 4 UUIDs as raw bytes."""
+    raw = gen.integers(0, 256, size = (count, 16), dtype = np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0f) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3f) | 0x80
+    return raw.view("V16").ravel()
+
+def _sample_sizes(
+    spec: LevelSpec, gen: np.random.Generator, shape: Union[int, Tuple[int, ...]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Draws room widths and heights."""
+    return (
+        gen.integers(spec.room_width.lower, spec.room_width.upper, size = shape, endpoint = True),
+        gen.integers(spec.room_height.lower, spec.room_height.upper, size = shape, endpoint = True),
+    )
+
+def _build_table(
+    spec: LevelSpec,
+    gen: np.random.Generator,
+    x: np.ndarray,
+    y: np.ndarray,
+    w: np.ndarray,
+    h: np.ndarray,
+    shop: np.ndarray,
+    stairs: np.ndarray,
+) -> RoomTable:
+    """Draws the remaining room features and packs everything into a table.
+    Shops never have monsters, treasure or traps."""
+    count = len(x)
+    flags = np.where(shop, SHOP, 0)
+    flags |= np.where(~shop & (gen.random(count) < spec.monster_chance), MONSTERS, 0)
+    flags |= np.where(~shop & (gen.random(count) < spec.treasure_chance), TREASURE, 0)
+    flags |= np.where(~shop & (gen.random(count) < spec.trap_chance), TRAP, 0)
+    return RoomTable(_random_ids(gen, count), x, y, w, h, flags, stairs)
+
+class _RectHash:
+    """A uniform spatial hash of rectangles, for constant time overlap
+    tests when rectangles are no larger than a cell."""
+
+    def __init__(self, cell: int):
+        self._cell = max(1, cell)
+        self._cells: Dict[Tuple[int, int], List[Tuple[int, int, int, int]]] = defaultdict(list)
+
+    def _keys(self, x: int, y: int, w: int, h: int) -> Iterator[Tuple[int, int]]:
+        for cx in range(x // self._cell, (x + w) // self._cell + 1):
+            for cy in range(y // self._cell, (y + h) // self._cell + 1):
+                yield (cx, cy)
+
+    def insert(self, x: int, y: int, w: int, h: int):
+        for key in self._keys(x, y, w, h):
+            self._cells[key].append((x, y, w, h))
+
+    def collides(self, x: int, y: int, w: int, h: int, gap: int = 0) -> bool:
+        """Returns True if the rectangle, grown by gap on every side,
+        overlaps any inserted rectangle."""
+        x, y, w, h = x - gap, y - gap, w + 2 * gap, h + 2 * gap
+        for key in self._keys(x, y, w, h):
+            for ox, oy, ow, oh in self._cells.get(key, ()):
+                if ox < x + w and x < ox + ow and oy < y + h and y < oy + oh:
+                    return True
+        return False
+
+def _avoids_overlaps(spec: LevelSpec) -> bool:
+    return not spec.extra.get("allow_overlap", True) or "min_room_gap" in spec.extra
+
+def _place_without_overlaps(
+    spec: LevelSpec,
+    rooms: RoomTable,
+    gen: np.random.Generator,
+    spread: Optional[Tuple[float, float]] = None,
+) -> RoomTable:
+    """Moves rooms that overlap, or come within min_room_gap of, a room
+    placed before them. Each room gets placement_retries new positions,
+    drawn over the whole level when spread is None, or from a normal
+    distribution with that spread around its first position. Rooms that
+    never fit are dropped, except for stair rooms, which are kept as is.
+    Stairs up are never moved."""
+    gap = spec.extra.get("min_room_gap", 0)
+    retries = spec.extra.get("placement_retries", 10)
+    count = len(rooms)
+    shape = (count, retries)
+    if spread is None:
+        cand_x = gen.integers(0, (spec.width - rooms.width)[:, None], size = shape, endpoint = True)
+        cand_y = gen.integers(0, (spec.height - rooms.height)[:, None], size = shape, endpoint = True)
+    else:
+        cand_x = rooms.x[:, None] + np.floor(gen.normal(0, spread[0], shape)).astype(np.int64)
+        cand_y = rooms.y[:, None] + np.floor(gen.normal(0, spread[1], shape)).astype(np.int64)
+
+    grid = _RectHash(max(spec.room_width.upper, spec.room_height.upper) + gap)
+    x, y = rooms.x.tolist(), rooms.y.tolist()
+    w, h = rooms.width.tolist(), rooms.height.tolist()
+    pinned = (rooms.stairs & Stairs.UP.value) != 0
+    for i in np.flatnonzero(pinned).tolist():
+        grid.insert(x[i], y[i], w[i], h[i])
+    keep = np.ones(count, dtype = bool)
+    for i in range(count):
+        if pinned[i]:
+            continue
+        options = zip([x[i]] + cand_x[i].tolist(), [y[i]] + cand_y[i].tolist())
+        for px, py in options:
+            if (
+                0 <= px <= spec.width - w[i]
+                and 0 <= py <= spec.height - h[i]
+                and not grid.collides(px, py, w[i], h[i], gap)
+            ):
+                x[i], y[i] = px, py
+                break
+        else:
+            if rooms.stairs[i] == Stairs.NONE.value:
+                keep[i] = False
+                continue
+        grid.insert(x[i], y[i], w[i], h[i])
+
+    placed = RoomTable(rooms.ids, x, y, rooms.width, rooms.height, rooms.flags, rooms.stairs)
+    return placed.select(keep)
+
+def UniformRoomBatch(
     spec: LevelSpec,
     up: List[Point],
-    use_towers: bool = False,
-) -> Generator[Room, None, None]:
-    """A generator that returns randomly created rooms."""
+    use_towers: bool,
+    rng: Random,
+) -> RoomTable:
+    """Returns a table of randomly created rooms. The first rooms hold the
+    stairs up (at the points in up) followed by the stairs down."""
+    gen = _numpy_rng(rng)
     stairs_up = len(up)
-    stairs_down = random.randint(spec.stairs_down.lower, spec.stairs_down.upper)
- 
-    for _ in range(max(random.randint(spec.rooms.lower, spec.rooms.upper), stairs_up + stairs_down)):
-        is_shop = random.random() < spec.shop_chance
-        w = random.randint(spec.room_width.lower, spec.room_width.upper)
-        h = random.randint(spec.room_height.lower, spec.room_height.upper)
-        location = Point(
-            random.randint(0, spec.width - w),
-            random.randint(0, spec.height - h),
-        )
-        stair = Stairs.NONE
-        if stairs_up > 0:
-            stairs_up -= 1
-            stair = Stairs.UP
-            is_shop = False
-            location = up[stairs_up]
-        elif stairs_down > 0:
-            stairs_down -= 1
-            stair = Stairs.DOWN
-            is_shop = False
-        if use_towers:
-            stair |= Stairs.DOWN
-        yield Room(
-            id = uuid4(),
-            location = location,
-            width = w,
-            height = h,
-            shop = is_shop,
-            monsters = False if is_shop else random.random() < spec.monster_chance,
-            treasure = False if is_shop else random.random() < spec.treasure_chance,
-            trap = False if is_shop else random.random() < spec.trap_chance,
-            stairs = stair,
-        )
+    stairs_down = rng.randint(spec.stairs_down.lower, spec.stairs_down.upper)
+    count = max(rng.randint(spec.rooms.lower, spec.rooms.upper), stairs_up + stairs_down)
 
-def ClusteredRoomFactory(
+    w, h = _sample_sizes(spec, gen, count)
+    x = gen.integers(0, spec.width - w, endpoint = True)
+    y = gen.integers(0, spec.height - h, endpoint = True)
+    x[:stairs_up] = [p.x for p in reversed(up)]
+    y[:stairs_up] = [p.y for p in reversed(up)]
+
+    stairs = np.full(count, Stairs.NONE.value, dtype = np.uint8)
+    stairs[:stairs_up] = Stairs.UP.value
+    stairs[stairs_up:stairs_up + stairs_down] = Stairs.DOWN.value
+    if use_towers:
+        stairs |= Stairs.DOWN.value
+
+    shop = gen.random(count) < spec.shop_chance
+    shop[:stairs_up + stairs_down] = False
+    rooms = _build_table(spec, gen, x, y, w, h, shop, stairs)
+    if _avoids_overlaps(spec):
+        rooms = _place_without_overlaps(spec, rooms, gen)
+    return rooms
+
+def ClusteredRoomBatch(
     spec: LevelSpec,
     up: List[Point],
-    use_towers: bool = False,
-) -> Generator[Room, None, None]:
-    """A generator that returns randomly created rooms in connecting clusters."""
+    use_towers: bool,
+    rng: Random,
+) -> RoomTable:
+    """Returns a table of randomly created rooms in connecting clusters."""
     std_mult = spec.extra.get("cluster_std", 2)
     start_count = spec.extra.get("cluster_starts", 5)
-    uniform_gen = UniformRoomFactory(spec, up, use_towers)
-    start_rooms: List[Room] = []
-    while room := next(uniform_gen, None):
-        if (
-            ((use_towers and not Stairs.UP in room.stairs)
-                or (not use_towers and room.stairs == Stairs.NONE))
-            and len(start_rooms) >= start_count
-        ):
+    uniform = UniformRoomBatch(spec, up, use_towers, rng)
+
+    # Every stair room plus at least start_count rooms seed a cluster
+    if use_towers:
+        plain = (uniform.stairs & Stairs.UP.value) == 0
+    else:
+        plain = uniform.stairs == Stairs.NONE.value
+    later_plain = np.flatnonzero(plain[start_count:])
+    starts = uniform[:start_count + int(later_plain[0]) if len(later_plain) else len(uniform)]
+    if len(starts) == 0:
+        return starts
+
+    # Each cluster is a chain of rooms, each placed around the previous one.
+    # Accepted positions are always positive, so truncating each gaussian
+    # sample equals adding the floor of its offset, and a chain is the
+    # running sum of floored offsets. Offsets that put a room out of bounds
+    # are redrawn, only for the chains where that happened.
+    gen = _numpy_rng(rng)
+    chain_len = max(0, int(spec.rooms.upper / len(starts)) - int(spec.rooms.lower / len(starts)))
+    shape = (len(starts), chain_len)
+    w, h = _sample_sizes(spec, gen, shape)
+    std = (std_mult * spec.room_width.upper, std_mult * spec.room_height.upper)
+    dx = np.floor(gen.normal(0, std[0], shape)).astype(np.int64)
+    dy = np.floor(gen.normal(0, std[1], shape)).astype(np.int64)
+    rows = np.arange(len(starts))
+    while True:
+        x = starts.x[rows, None] + np.cumsum(dx[rows], axis = 1)
+        y = starts.y[rows, None] + np.cumsum(dy[rows], axis = 1)
+        bad = (
+            (x <= 0) | (y <= 0)
+            | (x >= spec.width - w[rows]) | (y >= spec.height - h[rows])
+        )
+        failing = bad.any(axis = 1)
+        if not failing.any():
             break
-        start_rooms.append(room)
-        yield room
-    for start in start_rooms:
-        curr = start
-        for _ in range(int(spec.rooms.lower / len(start_rooms)), int(spec.rooms.upper / len(start_rooms))):
-            is_shop = random.random() < spec.shop_chance
-            w = random.randint(spec.room_width.lower, spec.room_width.upper)
-            h = random.randint(spec.room_height.lower, spec.room_height.upper)
-            location = Point(
-                int(random.gauss(curr.location.x, std_mult * spec.room_width.upper)),
-                int(random.gauss(curr.location.y, std_mult *  spec.room_height.upper)),
-            )
-            while (
-                location.x <= 0
-                or location.y <= 0
-                or location.x >= spec.width - w
-                or location.y >= spec.height - h
-            ):
-                location = Point(
-                    int(random.gauss(curr.location.x, std_mult * spec.room_width.upper)),
-                    int(random.gauss(curr.location.y, std_mult *  spec.room_height.upper)),
-                )
-
-            curr = Room(
-                id = uuid4(),
-                location = location,
-                width = w,
-                height = h,
-                shop = is_shop,
-                monsters = False if is_shop else random.random() < spec.monster_chance,
-                treasure = False if is_shop else random.random() < spec.treasure_chance,
-                trap = False if is_shop else random.random() < spec.trap_chance,
-                stairs = Stairs.DOWN if use_towers else Stairs.NONE,
-            )
-            yield curr
+        rows = rows[failing]
+        first_bad = bad[failing].argmax(axis = 1)
+        dx[rows, first_bad] = np.floor(gen.normal(0, std[0], len(rows)))
+        dy[rows, first_bad] = np.floor(gen.normal(0, std[1], len(rows)))
+    x = starts.x[:, None] + np.cumsum(dx, axis = 1)
+    y = starts.y[:, None] + np.cumsum(dy, axis = 1)
 
-def LinearRoomFactory(
+    count = x.size
+    shop = gen.random(count) < spec.shop_chance
+    stairs = np.full(count, (Stairs.DOWN if use_towers else Stairs.NONE).value, dtype = np.uint8)
+    clusters = _build_table(spec, gen, x.ravel(), y.ravel(), w.ravel(), h.ravel(), shop, stairs)
+    rooms = RoomTable.concat([starts, clusters])
+    if _avoids_overlaps(spec):
+        rooms = _place_without_overlaps(spec, rooms, gen, std)
+    return rooms
+
+def LinearRoomBatch(
     spec: LevelSpec,
     up: List[Point],
-    use_towers: bool = False,
-) -> Generator[Room, None, None]:
-    """A generator that returns randomly created rooms in linear rows."""
+    use_towers: bool,
+    rng: Random,
+) -> RoomTable:
+    """Returns a table of randomly created rooms in linear rows."""
     block_width = spec.extra.get("block_width", 120)
     block_height = spec.extra.get("block_height", 120)
     empty_block_chance = spec.extra.get("empty_block_chance", 0.2)
@@ -147,63 +268,78 @@ def LinearRoomFactory(
     )
 
     # Get starting rooms
-    uniform_gen = UniformRoomFactory(spec, up, use_towers)
-    room_count = 0
-    while room := next(uniform_gen, None):
-        if (
-            (use_towers and not Stairs.UP in room.stairs)
-            or (not use_towers and room.stairs == Stairs.NONE)
-        ):
-            break
-        room_count += 1
-        yield room
+    uniform = UniformRoomBatch(spec, up, use_towers, rng)
+    if use_towers:
+        room_count = int(np.count_nonzero(uniform.stairs & Stairs.UP.value))
+    else:
+        room_count = int(np.count_nonzero(uniform.stairs))
+    tables = [uniform[:room_count]]
     total_rooms = (
         spec.rooms.lower if spec.rooms.upper - room_count < spec.rooms.lower
-        else random.randint(spec.rooms.lower, spec.rooms.upper - room_count)
+        else rng.randint(spec.rooms.lower, spec.rooms.upper - room_count)
     )
     rooms_in_block = Bound(
         lower = int(total_rooms / block_count.upper),
         upper = int(total_rooms / block_count.lower),
     )
+    block_spec = spec.updated(
+        width = block_width,
+        height = block_height,
+        rooms = rooms_in_block,
+        room_alg = "uniform",
+        stairs_down = Bound(0, 0),
+    )
 
     # Generate rows of blocks
-    curr_y = random.randint(spec.room_height.lower, spec.room_height.upper)
+    curr_y = rng.randint(spec.room_height.lower, spec.room_height.upper)
     while curr_y + block_height <= spec.height:
-        curr_x = random.randint(spec.room_width.lower, spec.room_width.upper)
+        curr_x = rng.randint(spec.room_width.lower, spec.room_width.upper)
         while curr_x + block_width <= spec.width:
             # decide if we should skip and leave this an empty space
-            if random.random() < empty_block_chance:
-                curr_x += block_width + random.randint(spec.room_width.lower, spec.room_width.upper)
+            if rng.random() < empty_block_chance:
+                curr_x += block_width + rng.randint(spec.room_width.lower, spec.room_width.upper)
                 continue
-            rf = UniformRoomFactory(
-                spec.updated(
-                    width = block_width,
-                    height = block_height,
-                    rooms = rooms_in_block,
-                    room_alg = "uniform",
-                    stairs_down = Bound(0, 0),
-                ),
-                up = [],
-                use_towers = use_towers,
-            )
-
-            while room := next(rf, None):
-                yield Room(
-                    id = room.id,
-                    location = Point(
-                        curr_x + room.location.x,
-                        curr_y + room.location.y,
-                    ),
-                    width = room.width,
-                    height = room.height,
-                    monsters = room.monsters,
-                    treasure = room.treasure,
-                    trap = room.trap,
-                    shop = room.shop,
-                    stairs = room.stairs,
-                )
-            curr_x += block_width + random.randint(spec.room_width.lower, spec.room_width.upper)
-        curr_y += block_height + random.randint(spec.room_height.lower, spec.room_height.upper)
+            block = UniformRoomBatch(block_spec, up = [], use_towers = use_towers, rng = rng)
+            block.x += curr_x
+            block.y += curr_y
+            tables.append(block)
+            curr_x += block_width + rng.randint(spec.room_width.lower, spec.room_width.upper)
+        curr_y += block_height + rng.randint(spec.room_height.lower, spec.room_height.upper)
+    rooms = RoomTable.concat(tables)
+    if _avoids_overlaps(spec):
+        # Blocks already placed their own rooms apart, this only catches
+        # the stair rooms and gaps between neighbouring blocks.
+        rooms = _place_without_overlaps(
+            spec, rooms, _numpy_rng(rng), (spec.room_width.upper, spec.room_height.upper),
+        )
+    return rooms
+
+def UniformRoomFactory(
+    spec: LevelSpec,
+    up: List[Point],
+    use_towers: bool = False,
+    rng: Optional[Random] = None,
+) -> Generator[Room, None, None]:
+    """A generator that returns randomly created rooms."""
+    yield from UniformRoomBatch(spec, up, use_towers, rng if rng is not None else Random())
+
+def ClusteredRoomFactory(
+    spec: LevelSpec,
+    up: List[Point],
+    use_towers: bool = False,
+    rng: Optional[Random] = None,
+) -> Generator[Room, None, None]:
+    """A generator that returns randomly created rooms in connecting clusters."""
+    yield from ClusteredRoomBatch(spec, up, use_towers, rng if rng is not None else Random())
+
+def LinearRoomFactory(
+    spec: LevelSpec,
+    up: List[Point],
+    use_towers: bool = False,
+    rng: Optional[Random] = None,
+) -> Generator[Room, None, None]:
+    """A generator that returns randomly created rooms in linear rows."""
+    yield from LinearRoomBatch(spec, up, use_towers, rng if rng is not None else Random())
 
 
 # Mapping of names to generators
@@ -213,12 +349,32 @@ generator_map = {
     "linear": LinearRoomFactory,
 }
 
+# Mapping of names to batch generators
+batch_map = {
+    "uniform": UniformRoomBatch,
+    "clustered": ClusteredRoomBatch,
+    "linear": LinearRoomBatch,
+}
+
 def RoomFactory(
     spec: LevelSpec,
     up: List[Point],
     use_towers: bool = False,
+    rng: Optional[Random] = None,
 ) -> Generator[Room, None, None]:
     try:
-        return generator_map[spec.room_alg](spec, up, use_towers)
+        return generator_map[spec.room_alg](spec, up, use_towers, rng)
+    except KeyError:
+        raise Exception(f"{spec.room_alg} is not a recognized room creation algorithm.")
+
+def RoomBatch(
+    spec: LevelSpec,
+    up: List[Point],
+    use_towers: bool,
+    rng: Random,
+) -> RoomTable:
+    try:
+        batch = batch_map[spec.room_alg]
     except KeyError:
         raise Exception(f"{spec.room_alg} is not a recognized room creation algorithm.")
+    return batch(spec, up, use_towers, rng)
@@ -0,0 +1,163 @@
+import numpy as np
+import sys
+
+from typing import Iterable, Iterator, Sequence, Tuple, Union, overload
+from uuid import UUID
+
+from .rooms import Point, Room, Stairs
+
+# Bit positions of the boolean room features in the flags column
+MONSTERS = 1
+TREASURE = 2
+TRAP = 4
+SHOP = 8
+
+class RoomTable(Sequence[Room]):
+    """Column oriented storage for the rooms of a level.
+
+    Each room attribute is kept in its own NumPy array. Indexing or
+    iterating the table returns `Room` views built from the columns, so it
+    can be used anywhere a sequence of rooms is expected."""
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        x: np.ndarray,
+        y: np.ndarray,
+        width: np.ndarray,
+        height: np.ndarray,
+        flags: np.ndarray,
+        stairs: np.ndarray,
+    ):
+        self.ids = np.asarray(ids, dtype = "V16")
+        self.x = np.asarray(x, dtype = np.int64)
+        self.y = np.asarray(y, dtype = np.int64)
+        self.width = np.asarray(width, dtype = np.int64)
+        self.height = np.asarray(height, dtype = np.int64)
+        self.flags = np.asarray(flags, dtype = np.uint8)
+        self.stairs = np.asarray(stairs, dtype = np.uint8)
+
+    @classmethod
+    def from_rooms(cls, rooms: Iterable[Room]) -> "RoomTable":
+        """Packs rooms into a new table."""
+        rooms = list(rooms)
+        return cls(
+            ids = np.array([r.id.bytes for r in rooms], dtype = "V16"),
+            x = np.array([r.location.x for r in rooms], dtype = np.int64),
+            y = np.array([r.location.y for r in rooms], dtype = np.int64),
+            width = np.array([r.width for r in rooms], dtype = np.int64),
+            height = np.array([r.height for r in rooms], dtype = np.int64),
+            flags = np.array([
+                (MONSTERS if r.monsters else 0)
+                | (TREASURE if r.treasure else 0)
+                | (TRAP if r.trap else 0)
+                | (SHOP if r.shop else 0)
+                for r in rooms
+            ], dtype = np.uint8),
+            stairs = np.array([r.stairs.value for r in rooms], dtype = np.uint8),
+        )
+
+    @classmethod
+    def concat(cls, tables: Sequence["RoomTable"]) -> "RoomTable":
+        """Joins tables end to end into a new table."""
+        return cls(
+            ids = np.concatenate([t.ids for t in tables] or [np.empty(0, "V16")]),
+            x = np.concatenate([t.x for t in tables] or [np.empty(0, np.int64)]),
+            y = np.concatenate([t.y for t in tables] or [np.empty(0, np.int64)]),
+            width = np.concatenate([t.width for t in tables] or [np.empty(0, np.int64)]),
+            height = np.concatenate([t.height for t in tables] or [np.empty(0, np.int64)]),
+            flags = np.concatenate([t.flags for t in tables] or [np.empty(0, np.uint8)]),
+            stairs = np.concatenate([t.stairs for t in tables] or [np.empty(0, np.uint8)]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @overload
+    def __getitem__(self, i: int) -> Room: ...
+
+    @overload
+    def __getitem__(self, i: slice) -> "RoomTable": ...
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Room, "RoomTable"]:
+        if isinstance(i, slice):
+            return self.select(i)
+        flags = int(self.flags[i])
+        return Room(
+            id = UUID(bytes = bytes(self.ids[i])),
+            location = Point(int(self.x[i]), int(self.y[i])),
+            width = int(self.width[i]),
+            height = int(self.height[i]),
+            monsters = bool(flags & MONSTERS),
+            treasure = bool(flags & TREASURE),
+            trap = bool(flags & TRAP),
+            shop = bool(flags & SHOP),
+            stairs = Stairs(int(self.stairs[i])),
+        )
+
+    def select(self, rows: Union[slice, np.ndarray]) -> "RoomTable":
+        """Returns a new table holding the rows picked by a slice, index
+        array or boolean mask."""
+        return RoomTable(
+            self.ids[rows], self.x[rows], self.y[rows], self.width[rows],
+            self.height[rows], self.flags[rows], self.stairs[rows],
+        )
+
+    def __iter__(self) -> Iterator[Room]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def index(self, room: Room, start: int = 0, stop: int = sys.maxsize) -> int:
+        """Returns the row holding room."""
+        rows = np.flatnonzero(self.ids[start:stop] == np.void(room.id.bytes))
+        if len(rows) == 0:
+            raise ValueError(f"Room {room.id} is not in the table")
+        return int(rows[0]) + start
+
+    def points(self) -> Sequence[Tuple[int, int]]:
+        """Returns the location of every room as plain integer pairs."""
+        return list(zip(self.x.tolist(), self.y.tolist()))
+
+    def with_stairs(self, stairs: Stairs) -> Sequence[Point]:
+        """Returns the locations of rooms that have the given stairs."""
+        rows = np.flatnonzero(self.stairs & stairs.value)
+        return [Point(int(self.x[i]), int(self.y[i])) for i in rows]
+
+    def bounds(self) -> Tuple[int, int, int, int]:
+        """Returns (left, top, right, bottom) of the area covered by rooms."""
+        if len(self) == 0:
+            return (0, 0, 0, 0)
+        return (
+            int(self.x.min()),
+            int(self.y.min()),
+            int((self.x + self.width).max()),
+            int((self.y + self.height).max()),
+        )
+
+    def centers(self) -> np.ndarray:
+        """Returns an (n, 2) array of room center points."""
+        return np.column_stack((
+            self.x + self.width / 2,
+            self.y + self.height / 2,
+        ))
+
+    def overlapping(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        """Returns a mask of the rooms that overlap the given rectangle."""
+        return (
+            (self.x < x + width)
+            & (x < self.x + self.width)
+            & (self.y < y + height)
+            & (y < self.y + self.height)
+        )
+
+    def overlaps(self) -> np.ndarray:
+        """Returns an (n, n) mask where [i, j] is set if rooms i and j
+        overlap. The diagonal is left unset."""
+        mask = (
+            (self.x[:, None] < (self.x + self.width)[None, :])
+            & (self.x[None, :] < (self.x + self.width)[:, None])
+            & (self.y[:, None] < (self.y + self.height)[None, :])
+            & (self.y[None, :] < (self.y + self.height)[:, None])
+        )
+        np.fill_diagonal(mask, False)
+        return mask
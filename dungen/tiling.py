@@ -0,0 +1,183 @@
+import numpy as np
+
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from random import Random
+from typing import List, Optional, Tuple
+
+from . import profiling
+from .connections import Bound, Connections
+from .level import Level
+from .rooms import Point
+from .room_generators import LevelSpec, RoomBatch
+from .room_table import RoomTable
+
+
+@dataclass(frozen=True)
+class Tile:
+    """A rectangular part of a floor, in grid units."""
+    column: int
+    row: int
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+def uses_tiles(spec: LevelSpec) -> bool:
+    """Returns True if floors of spec are large enough to be tiled."""
+    size = spec.extra.get("tile_size")
+    return size is not None and (spec.width > size or spec.height > size)
+
+def split_floor(spec: LevelSpec) -> List[Tile]:
+    """Splits the floor into a grid of tiles no smaller than tile_size.
+    The last row and column take up any remainder."""
+    size = spec.extra["tile_size"]
+    if size < max(spec.room_width.upper, spec.room_height.upper):
+        raise Exception(f"tile_size {size} is smaller than the largest room of {spec.name}.")
+    columns = max(1, spec.width // size)
+    rows = max(1, spec.height // size)
+    tile_w = spec.width // columns
+    tile_h = spec.height // rows
+    return [
+        Tile(
+            c, r, c * tile_w, r * tile_h,
+            spec.width - c * tile_w if c == columns - 1 else tile_w,
+            spec.height - r * tile_h if r == rows - 1 else tile_h,
+        )
+        for r in range(rows) for c in range(columns)
+    ]
+
+def layout_tile(
+    spec: LevelSpec,
+    tile: Tile,
+    up: List[Point],
+    towers: bool,
+    rng: Random,
+) -> Tuple[RoomTable, List[Tuple[int, int]]]:
+    """Generates the rooms and pruned hallways of one tile. Rooms are
+    returned in floor coordinates and hallways as pairs of room indexes,
+    which are cheap to send back from a worker process."""
+    with profiling.stage("tile", column = tile.column, row = tile.row):
+        local_up = [Point(p.x - tile.x, p.y - tile.y) for p in up]
+        rooms = RoomBatch(spec, local_up, towers, rng)
+        rooms.x += tile.x
+        rooms.y += tile.y
+        hallways = Connections(
+            rooms,
+            candidates = spec.extra.get("hall_candidates", "complete"),
+            neighbors = spec.extra.get("hall_neighbors", 8),
+        )
+        hallways.prune(spec.hall_density, rng)
+    return (rooms, hallways.pairs())
+
+def _border_rooms(rooms: RoomTable, coord: np.ndarray, border: int, count: int) -> np.ndarray:
+    """Returns the indexes of the count rooms closest to a tile border."""
+    return np.argsort(np.abs(coord - border), kind = "stable")[:count]
+
+def stitch_pairs(
+    tiles: List[Tile],
+    tables: List[RoomTable],
+    offsets: List[int],
+    links: int = 1,
+    candidates: int = 16,
+) -> List[Tuple[int, int]]:
+    """Returns hallways joining each tile to its right and lower neighbour,
+    as pairs of indexes into the concatenated room tables. Each boundary
+    gets the links shortest hallways between the candidates rooms on either
+    side closest to it."""
+    index = {(t.column, t.row): i for i, t in enumerate(tiles)}
+    pairs: List[Tuple[int, int]] = []
+    for a, tile in enumerate(tiles):
+        for b, horizontal in (
+            (index.get((tile.column + 1, tile.row)), True),
+            (index.get((tile.column, tile.row + 1)), False),
+        ):
+            if b is None or len(tables[a]) == 0 or len(tables[b]) == 0:
+                continue
+            ra, rb = tables[a], tables[b]
+            if horizontal:
+                border = tiles[b].x
+                near_a = _border_rooms(ra, ra.x + ra.width, border, candidates)
+                near_b = _border_rooms(rb, rb.x, border, candidates)
+            else:
+                border = tiles[b].y
+                near_a = _border_rooms(ra, ra.y + ra.height, border, candidates)
+                near_b = _border_rooms(rb, rb.y, border, candidates)
+            dist = (
+                np.abs(ra.x[near_a, None] - rb.x[None, near_b])
+                + np.abs(ra.y[near_a, None] - rb.y[None, near_b])
+            )
+            for flat in np.argsort(dist, axis = None, kind = "stable")[:links].tolist():
+                i, j = divmod(flat, len(near_b))
+                pairs.append((offsets[a] + int(near_a[i]), offsets[b] + int(near_b[j])))
+    return pairs
+
+def layout_tiled(
+    spec: LevelSpec,
+    up: List[Point],
+    towers: bool,
+    rng: Random,
+    executor: Optional[Executor] = None,
+) -> Level:
+    """Lays out a large floor as independent tiles, generated in parallel
+    when an executor is given, and stitches neighbouring tiles together
+    with boundary hallways.
+
+    Each tile gets a share of the floor's rooms proportional to its area
+    and the stairs up that fall inside it. Stairs down are spread over
+    random tiles."""
+    tiles = split_floor(spec)
+    area = spec.width * spec.height
+    stairs_down = rng.randint(spec.stairs_down.lower, spec.stairs_down.upper)
+    down_counts = [0] * len(tiles)
+    for t in rng.choices(range(len(tiles)), k = stairs_down):
+        down_counts[t] += 1
+
+    def tile_of(p: Point) -> int:
+        for i, t in enumerate(tiles):
+            if t.x <= p.x < t.x + t.width and t.y <= p.y < t.y + t.height:
+                return i
+        return len(tiles) - 1
+
+    tile_up: List[List[Point]] = [[] for _ in tiles]
+    for p in up:
+        tile_up[tile_of(p)].append(p)
+
+    base = rng.getrandbits(64)
+    jobs = []
+    for i, tile in enumerate(tiles):
+        share = tile.width * tile.height / area
+        tile_spec = spec.updated(
+            width = tile.width,
+            height = tile.height,
+            rooms = Bound(max(1, int(spec.rooms.lower * share)), max(1, int(spec.rooms.upper * share))),
+            stairs_down = Bound(down_counts[i], down_counts[i]),
+        )
+        jobs.append((tile_spec, tile, tile_up[i], towers, Random(f"{base}:{i}")))
+
+    if executor is None:
+        results = [layout_tile(*job) for job in jobs]
+    else:
+        futures = [
+            executor.submit(
+                profiling.run_recorded, profiling.enabled(), layout_tile,
+                job_spec, job_tile, job_up, towers, job_rng,
+            ) for job_spec, job_tile, job_up, _, job_rng in jobs
+        ]
+        results = []
+        for future in futures:
+            result, records = future.result()
+            profiling.add_records(records)
+            results.append(result)
+
+    with profiling.stage("stitch"):
+        tables = [rooms for rooms, _ in results]
+        offsets = list(np.cumsum([0] + [len(t) for t in tables[:-1]]).tolist())
+        pairs = [
+            (offsets[t] + i, offsets[t] + j)
+            for t, (_, tile_pairs) in enumerate(results) for i, j in tile_pairs
+        ]
+        pairs += stitch_pairs(tiles, tables, offsets, spec.extra.get("stitch_hallways", 1))
+        rooms = RoomTable.concat(tables)
+        return Level.from_parts(spec.width, spec.height, rooms, Connections.from_pairs(rooms, pairs))
@@ -0,0 +1,256 @@
+# Times the main stages of dungeon generation and savefile access, and
+# records the results as JSON so runs can be compared.
+#
+#   python utils/benchmark.py example_spec.yml --out bench.json
+#   python utils/benchmark.py example_spec.yml --compare bench.json
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from copy import deepcopy
+from dungen import DungenSave
+from dungen.connections import Bound, Connections
+from dungen.drawing import write_svg
+from dungen.floor_lod import DETAIL_LEVELS, draw_detail
+from dungen.dungen import drawer_map
+from dungen.dunspec import DunSpec, rng_stream
+from dungen.level import Level
+from dungen.level_drawer import handle_no_floors
+from dungen.room_generators import LevelSpec, RoomBatch
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+parser = argparse.ArgumentParser(description="Benchmark dungen generation stages")
+parser.add_argument(
+    "spec",
+    help = "DunSpec file to take floor settings and textures from",
+    type = Path,
+)
+parser.add_argument(
+    "--scale",
+    help = "Multiplier applied to the room counts of the spec",
+    type = float,
+    default = 1.0,
+)
+parser.add_argument(
+    "--repeat",
+    help = "Number of timed runs per case",
+    type = int,
+    default = 3,
+)
+parser.add_argument(
+    "--filter",
+    help = "Only run cases whose name contains this text",
+    default = "",
+)
+parser.add_argument(
+    "--out",
+    help = "Write results to this JSON file",
+    type = Path,
+    default = None,
+)
+parser.add_argument(
+    "--compare",
+    help = "Compare against results in this JSON file",
+    type = Path,
+    default = None,
+)
+parser.add_argument(
+    "--threshold",
+    help = "Fraction a case may slow down before it counts as a regression",
+    type = float,
+    default = 0.2,
+)
+args = parser.parse_args()
+
+# Texture paths in specs are relative to where dungen runs from
+spec_file = args.spec.resolve()
+out_file = args.out.resolve() if args.out is not None else None
+compare_file = args.compare.resolve() if args.compare is not None else None
+os.chdir(spec_file.parent)
+spec = DunSpec.from_yaml(spec_file)
+base = spec.levels[0]
+scale = spec.scale
+textures = spec.textures[base]
+rooms = Bound(int(base.rooms.lower * args.scale), int(base.rooms.upper * args.scale))
+base = base.updated(rooms = rooms, floors = Bound(3, 3))
+
+Case = Tuple[str, Callable[[], Callable[[], Any]], bool]
+cases: List[Case] = []
+
+def case(name: str, fresh: bool = False):
+    """Registers a benchmark. The decorated function does any untimed setup
+    and returns the callable to time. With fresh, it returns a callable run
+    untimed before each repeat, which returns the callable to time, for
+    cases that change or consume their inputs."""
+    def register(setup: Callable[[], Callable[[], Any]]):
+        cases.append((name, setup, fresh))
+        return setup
+    return register
+
+def level_for(alg: str = "uniform", **extra) -> LevelSpec:
+    return base.updated(room_alg = alg, extra = base.extra | extra)
+
+for alg in ("uniform", "clustered", "linear"):
+    @case(f"rooms/{alg}")
+    def _(alg = alg):
+        ls = level_for(alg)
+        return lambda: RoomBatch(ls, [], False, rng_stream(0, "rooms"))
+
+for mode in ("complete", "nearest"):
+    @case(f"connections/{mode}/build")
+    def _(mode = mode):
+        table = RoomBatch(level_for(), [], False, rng_stream(0, "rooms"))
+        return lambda: Connections(table, candidates = mode)
+
+    @case(f"connections/{mode}/prune")
+    def _(mode = mode):
+        table = RoomBatch(level_for(), [], False, rng_stream(0, "rooms"))
+        def run():
+            conn = Connections(table, candidates = mode)
+            conn.prune(base.hall_density, rng_stream(0, "prune"))
+        return run
+
+for shape in ("rect", "mixed", "organic"):
+    @case(f"draw/{shape}")
+    def _(shape = shape):
+        level = Level(level_for(hall_candidates = "nearest"), [], False, rng_stream(0, "level"))
+        drawer = drawer_map[shape]
+        return lambda: drawer.draw_level(
+            level, textures, scale = scale, hall_width = base.hall_width, rng = rng_stream(0, "draw"),
+        )
+
+@case("draw/organic/simplified")
+def _():
+    level = Level(level_for(hall_candidates = "nearest"), [], False, rng_stream(0, "level"))
+    return lambda: drawer_map["organic"].draw_level(
+        level, textures, scale = scale, hall_width = base.hall_width, rng = rng_stream(0, "draw"),
+        path_tolerance = 0.5,
+    )
+
+@case("draw/organic/overview")
+def _():
+    level = Level(level_for(hall_candidates = "nearest"), [], False, rng_stream(0, "level"))
+    img = drawer_map["organic"].draw_level(
+        level, textures, scale = scale, hall_width = base.hall_width, rng = rng_stream(0, "draw"),
+    )
+    return lambda: draw_detail(img, DETAIL_LEVELS[-1], scale)
+
+def drawn_floors(count: int = 3):
+    level = Level(level_for(hall_candidates = "nearest"), [], False, rng_stream(0, "level"))
+    return [
+        drawer_map["rect"].draw_level(level, textures, scale = scale, rng = rng_stream(0, "draw", i))
+        for i in range(count)
+    ]
+
+@case("handle_no_floors", fresh = True)
+def _():
+    floors = drawn_floors()
+    def prepare():
+        imgs = deepcopy(floors)
+        return lambda: handle_no_floors(imgs, scale)
+    return prepare
+
+@case("serialize")
+def _():
+    img = drawn_floors(1)[0]
+    return lambda: str(img)
+
+tmpdir = tempfile.TemporaryDirectory()
+
+@case("serialize/stream")
+def _():
+    img = drawn_floors(1)[0]
+    def run():
+        with (Path(tmpdir.name) / "stream.svg").open("w") as f:
+            write_svg(img, f)
+    return run
+
+@case("savefile/add_level", fresh = True)
+def _():
+    imgs = {i + 1: img for i, img in enumerate(drawn_floors())}
+    def prepare():
+        save = DungenSave(Path(tmpdir.name) / f"add_{time.perf_counter_ns()}.dng", scale = scale)
+        return lambda: save.add_level(1, imgs, "Benchmark level")
+    return prepare
+
+def saved_level() -> DungenSave:
+    path = Path(tmpdir.name) / f"get_{time.perf_counter_ns()}.dng"
+    save = DungenSave(path, scale = scale)
+    save.add_level(1, {i + 1: img for i, img in enumerate(drawn_floors())}, "Benchmark level")
+    return save
+
+@case("savefile/get_floor")
+def _():
+    save = saved_level()
+    return lambda: save.get_floor(1, 2)
+
+@case("savefile/floor_count")
+def _():
+    save = saved_level()
+    return lambda: [save.floor_count(1) for _ in range(20)]
+
+@case("savefile/set_floor")
+def _():
+    save = saved_level()
+    floor = save.get_floor(1, 2)
+    if floor is None:
+        raise Exception("Benchmark savefile is missing a floor")
+    return lambda: save.set_floor(1, 2, floor)
+
+results: Dict[str, Dict[str, float]] = {}
+for name, setup, fresh in cases:
+    if args.filter not in name:
+        continue
+    fn = setup()
+    times = []
+    for _ in range(args.repeat):
+        run = fn() if fresh else fn
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    results[name] = {
+        "min": min(times),
+        "mean": statistics.mean(times),
+        "runs": len(times),
+    }
+    print(f"{name:32} min {min(times):9.4f}s  mean {statistics.mean(times):9.4f}s", flush = True)
+tmpdir.cleanup()
+
+report = {
+    "meta": {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "spec": str(spec_file),
+        "scale": args.scale,
+        "rooms": [rooms.lower, rooms.upper],
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    },
+    "results": results,
+}
+if out_file is not None:
+    out_file.write_text(json.dumps(report, indent = 2))
+
+if compare_file is not None:
+    previous = json.loads(compare_file.read_text())["results"]
+    regressions = []
+    print(f"\n{'case':32} {'before':>10} {'after':>10} {'change':>8}")
+    for name, res in results.items():
+        if name not in previous:
+            continue
+        before, after = previous[name]["min"], res["min"]
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ""
+        if change > args.threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:32} {before:10.4f} {after:10.4f} {change:+8.1%}{flag}")
+    if regressions:
+        print(f"\n{len(regressions)} case(s) slowed down by more than {args.threshold:.0%}.", file = sys.stderr)
+        sys.exit(1)
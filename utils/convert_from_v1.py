@@ -154,3 +154,4 @@ for levelid, floors in old_save.__dict__["images"].items():
 
         images[floorid] = image
     new_save.add_level(levelid, images, old_save.__dict__["level_notes"][levelid])
+new_save.close()